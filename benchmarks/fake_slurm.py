@@ -0,0 +1,138 @@
+"""Local stand-in for the SLURM commands sbatch, scancel, scontrol, squeue and sacct.
+
+Invoked as "fake_slurm.py COMMAND ARGS...". All state is kept in the directory given by the
+environment variable FAKE_SLURM_STATE:
+    next_id     next job id to hand out
+    jobs        append-only log of "job_id state" lines
+    calls       append-only log of all invocations
+
+The behaviour is controlled by the following environment variables:
+    FAKE_SLURM_LATENCY          seconds each command takes (default 0)
+    FAKE_SLURM_CONTENTION       probability that other users submit jobs between two sbatch calls (default 0)
+    FAKE_SLURM_FAILURE_RATE     probability that a command fails transiently (default 0)
+"""
+import fcntl
+import os
+import random
+import re
+import sys
+import time
+
+state_dir = os.environ["FAKE_SLURM_STATE"]
+latency = float(os.environ.get("FAKE_SLURM_LATENCY", "0"))
+contention = float(os.environ.get("FAKE_SLURM_CONTENTION", "0"))
+failure_rate = float(os.environ.get("FAKE_SLURM_FAILURE_RATE", "0"))
+
+
+class Lock(object):
+    def __enter__(self):
+        self.f = open(os.path.join(state_dir, "lock"), 'a')
+        fcntl.flock(self.f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
+
+
+def append(name, line):
+    with open(os.path.join(state_dir, name), 'a') as f:
+        f.write(line + "\n")
+
+
+def job_states():
+    states = {}
+    try:
+        with open(os.path.join(state_dir, "jobs"), 'r') as f:
+            for line in f:
+                job_id, state = line.split()
+                if state == "REMOVED":
+                    states.pop(job_id, None)
+                else:
+                    states[job_id] = state
+    except IOError:
+        pass
+    return states
+
+
+def sbatch(args):
+    held = "--hold" in args
+    array = None
+    for arg in args:
+        m = re.match(r"--array=(\d+)-(\d+)$", arg)
+        if m:
+            array = range(int(m.group(1)), int(m.group(2)) + 1)
+    with Lock():
+        path = os.path.join(state_dir, "next_id")
+        try:
+            with open(path, 'r') as f:
+                job_id = int(f.read())
+        except IOError:
+            job_id = 1000
+        # jobs of other users take some of the following ids
+        next_id = job_id + 1
+        while random.random() < contention:
+            next_id += 1
+        with open(path, 'w') as f:
+            f.write(str(next_id))
+        state = "PENDING" if not held else "HELD"
+        if array is None:
+            append("jobs", "%d %s" % (job_id, state))
+        else:
+            for task in array:
+                append("jobs", "%d_%d %s" % (job_id, task, state))
+    print "Submitted batch job %d" % job_id
+
+
+def scancel(args):
+    with Lock():
+        for job_id in args:
+            if not job_id.startswith("-"):
+                append("jobs", "%s REMOVED" % job_id)
+
+
+def scontrol(args):
+    if args[:1] == ["release"]:
+        with Lock():
+            for job_id in args[1].split(","):
+                append("jobs", "%s PENDING" % job_id)
+    elif args[:2] == ["show", "job"]:
+        state = job_states().get(args[2], "COMPLETED")
+        print "   JobState=%s Reason=None Dependency=(null)" % state
+
+
+def squeue(args):
+    for job_id, state in sorted(job_states().items()):
+        print "%s %s %s" % (job_id, job_id, "PENDING" if state == "HELD" else state)
+
+
+def sacct(args):
+    job_ids = []
+    for arg in args:
+        if arg.startswith("--jobs="):
+            job_ids = arg[len("--jobs="):].split(",")
+    states = job_states()
+    for job_id in job_ids:
+        print "%s|%s" % (job_id, "PENDING" if job_id in states else "COMPLETED")
+
+
+commands = {"sbatch": sbatch, "scancel": scancel, "scontrol": scontrol, "squeue": squeue, "sacct": sacct}
+
+
+def main():
+    command, args = sys.argv[1], sys.argv[2:]
+    append("calls", " ".join([command] + args))
+    time.sleep(latency)
+    if random.random() < failure_rate:
+        # sbatch is only retried if the controller was not reached, other commands after any error
+        if command == "sbatch":
+            sys.stderr.write("sbatch: error: Batch job submission failed: "
+                             "Unable to contact slurm controller (connect failure)\n")
+        else:
+            sys.stderr.write("%s: error: Socket timed out on send/recv operation\n" % command)
+        sys.exit(1)
+    commands[command](args)
+
+
+if __name__ == '__main__':
+    main()
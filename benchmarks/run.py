@@ -0,0 +1,266 @@
+"""Benchmarks for job submission and grid generation that run without a SLURM cluster.
+
+The SLURM commands are replaced by fake_slurm.py, which hands out increasing job ids with
+configurable latency, contention by other users and transient failures.
+
+Usage:
+    python benchmarks/run.py --sizes 1000,10000 --output results.json
+    python benchmarks/run.py --compare results.json
+
+Results are written as JSON together with the git commit, so that runs of different commits
+can be compared with --compare.
+"""
+import json
+import logging
+import os
+import os.path
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+
+from submit import jobsubmitter
+from submit.manifest import Manifest
+from submit.gridsearch import GridSearch
+from startup import measure_startup
+
+fake_commands = ["sbatch", "scancel", "scontrol", "squeue", "sacct"]
+
+config_template = """# SUBMIT: runner = python
+# SUBMIT: gpu = %(gpu)s
+# SBATCH --mem=1G
+# SBATCH --time=%(time)s
+learning_rate = 0.1
+"""
+
+
+def install_fake_slurm(work_dir):
+    """Creates the fake SLURM commands in work_dir and puts them first on PATH."""
+    bin_dir = os.path.join(work_dir, "bin")
+    state_dir = os.path.join(work_dir, "slurm-state")
+    os.makedirs(bin_dir)
+    os.makedirs(state_dir)
+    fake_slurm = os.path.join(repo_dir, "benchmarks", "fake_slurm.py")
+    for command in fake_commands:
+        path = os.path.join(bin_dir, command)
+        with open(path, 'w') as f:
+            f.write('#!/bin/sh\nexec "%s" "%s" %s "$@"\n' % (sys.executable, fake_slurm, command))
+        os.chmod(path, 0o755)
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ["PATH"]
+    os.environ["FAKE_SLURM_STATE"] = state_dir
+    return state_dir
+
+
+def count_calls(state_dir):
+    try:
+        with open(os.path.join(state_dir, "calls"), 'r') as f:
+            return sum(1 for _ in f)
+    except IOError:
+        return 0
+
+
+def make_tree(root, n, gpu="no", n_variants=1):
+    """Creates n job directories below root and returns their paths.
+    Directories are spread over n_variants different --time options."""
+    directories = []
+    for i in range(n):
+        directory = os.path.join(root, "%06d" % i)
+        os.makedirs(directory)
+        with open(os.path.join(directory, "cfg.py"), 'w') as f:
+            f.write(config_template % {"gpu": gpu, "time": "%d:00:00" % (1 + i % n_variants)})
+        directories.append(directory)
+    return directories
+
+
+def make_submitter(work_dir, **kwargs):
+    return jobsubmitter.JobSubmitter(script=os.path.join(repo_dir, "submit", "job-script.sh"),
+                                     cfg_files=["cfg.py"], slurm_options=[],
+                                     prolog=os.path.join(repo_dir, "submit", "prolog.sh"),
+                                     state_dir=os.path.join(work_dir, ".submit"),
+                                     retries=5, retry_delay=0.01, **kwargs)
+
+
+def check_results(results, skipped=()):
+    """Raises a RuntimeError if a directory failed to submit for a reason other than those in skipped."""
+    errors = [r for r in results if isinstance(r, jobsubmitter.SubmissionError) and r.message not in skipped]
+    if errors:
+        raise RuntimeError("%d directories failed to submit, e.g.: %s" % (len(errors), errors[0].message))
+
+
+def bench_submit(work_dir, n, mode, gpu="no"):
+    """Submits a synthetic tree of n directories and returns a list of measured results.
+    The manifest mode also measures a second run with --update after all jobs finished."""
+    root = tempfile.mkdtemp(prefix="tree-", dir=work_dir)
+    directories = make_tree(root, n, gpu=gpu, n_variants=4)
+    state_dir = os.environ["FAKE_SLURM_STATE"]
+    calls_before = count_calls(state_dir)
+
+    start = time.time()
+    if mode == "serial":
+        js = make_submitter(work_dir)
+        results = [js.try_submit_directory(directory) for directory in directories]
+    elif mode.startswith("jobs"):
+        js = make_submitter(work_dir)
+        results = [result for directory, result in
+                   js.iter_submit_directories(directories, jobs=int(mode[len("jobs"):]))]
+    elif mode == "array":
+        js = make_submitter(work_dir)
+        results = [result for directory, result in js.submit_directories(directories)]
+    elif mode == "manifest":
+        js = make_submitter(work_dir, update=True,
+                            manifest=Manifest(os.path.join(root, "manifest.json")))
+        results = [js.try_submit_directory(directory) for directory in directories]
+        js.manifest.save()
+    else:
+        raise ValueError("unknown mode %s" % mode)
+    duration = time.time() - start
+    check_results(results)
+    measured = [{"name": "submit_%s_%s" % (gpu, mode), "n": n, "seconds": duration, "per_second": n / duration,
+                 "slurm_calls": count_calls(state_dir) - calls_before}]
+
+    if mode == "manifest":
+        # the rerun only needs the manifest and the markers, as all directories are current
+        for directory in directories:
+            with open(os.path.join(directory, "_finished"), 'w'):
+                pass
+        calls_before = count_calls(state_dir)
+        start = time.time()
+        js = make_submitter(work_dir, update=True,
+                            manifest=Manifest(os.path.join(root, "manifest.json")))
+        results = [js.try_submit_directory(directory) for directory in directories]
+        js.manifest.save()
+        duration = time.time() - start
+        check_results(results, skipped=["current"])
+        measured.append({"name": "submit_%s_%s_warm" % (gpu, mode), "n": n, "seconds": duration,
+                         "per_second": n / duration, "slurm_calls": count_calls(state_dir) - calls_before})
+
+    shutil.rmtree(root)
+    return measured
+
+
+def bench_generate(work_dir, n_points, template_size, workers=1, dry_run=False):
+    """Generates a grid of about n_points points with a template of template_size bytes."""
+    root = tempfile.mkdtemp(prefix="grid-", dir=work_dir)
+    side = int(round(n_points ** 0.5))
+    body = "a = $A$\nb = $B$\nindex = $CFG_INDEX$\n"
+    filler = "# " + "x" * 70 + "\n"
+    template = body + filler * max(0, (template_size - len(body)) // len(filler))
+    gs = GridSearch(os.path.join(root, "$CFG_INDEX$", "cfg.py"), template,
+                    {"a": "1:%d" % side, "b": "1:%d" % side})
+
+    start = time.time()
+    n = gs.generate(workers=workers, dry_run=dry_run, progress_interval=0)
+    duration = time.time() - start
+
+    shutil.rmtree(root)
+    return {"name": "generate_%dB_%s" % (template_size, "dry" if dry_run else "w%d" % workers),
+            "n": n, "seconds": duration, "per_second": n / duration}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=repo_dir).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_path, new):
+    with open(old_path, 'r') as f:
+        old = json.load(f)
+    old_results = dict(((r["name"], r["n"]), r) for r in old["results"])
+    print "%-32s %8s %12s %12s %8s" % ("benchmark", "n", "old/s", "new/s", "ratio")
+    for r in new["results"]:
+        o = old_results.get((r["name"], r["n"]))
+        if o:
+            print "%-32s %8d %12.1f %12.1f %8.2f" % (r["name"], r["n"], o["per_second"], r["per_second"],
+                                                      r["per_second"] / o["per_second"])
+        else:
+            print "%-32s %8d %12s %12.1f %8s" % (r["name"], r["n"], "-", r["per_second"], "-")
+
+
+def main():
+    arg_parser = ArgumentParser(description="Benchmark job submission and grid generation.")
+    arg_parser.add_argument("--sizes", default="1000",
+                            help="comma-separated numbers of directories to submit")
+    arg_parser.add_argument("--submit-modes", default="serial,jobs8,array,manifest",
+                            help="comma-separated submission modes (serial, jobsN, array, manifest)")
+    arg_parser.add_argument("--prefer-size", type=int, default=200,
+                            help="number of GPU-prefer directories to submit")
+    arg_parser.add_argument("--grid-sizes", default="10000",
+                            help="comma-separated numbers of grid points to generate")
+    arg_parser.add_argument("--template-sizes", default="200,20000",
+                            help="comma-separated template sizes in bytes")
+    arg_parser.add_argument("--latency", type=float, default=0.02,
+                            help="seconds each fake SLURM command takes")
+    arg_parser.add_argument("--contention", type=float, default=0.3,
+                            help="probability that other users submit jobs between two sbatch calls")
+    arg_parser.add_argument("--failure-rate", type=float, default=0.0,
+                            help="probability that a fake SLURM command fails transiently")
+    arg_parser.add_argument("--skip-submit", action='store_true', help="do not run submission benchmarks")
+    arg_parser.add_argument("--skip-generate", action='store_true', help="do not run generation benchmarks")
+    arg_parser.add_argument("--skip-startup", action='store_true', help="do not measure the startup time")
+    arg_parser.add_argument("--output", "-o", help="file to write the results to")
+    arg_parser.add_argument("--compare", help="results of an earlier run to compare with")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig()
+    logging.getLogger().setLevel(logging.WARNING)
+    os.environ["FAKE_SLURM_LATENCY"] = str(args.latency)
+    os.environ["FAKE_SLURM_CONTENTION"] = str(args.contention)
+    os.environ["FAKE_SLURM_FAILURE_RATE"] = str(args.failure_rate)
+
+    work_dir = tempfile.mkdtemp(prefix="submit-bench-")
+    results = []
+    try:
+        install_fake_slurm(work_dir)
+        if not args.skip_submit:
+            for n in [int(x) for x in args.sizes.split(",")]:
+                for mode in args.submit_modes.split(","):
+                    for result in bench_submit(work_dir, n, mode):
+                        results.append(result)
+                        print "%-32s %8d %10.2f s %10.1f/s" % (result["name"], n, result["seconds"],
+                                                                result["per_second"])
+            if args.prefer_size:
+                for result in bench_submit(work_dir, args.prefer_size, "serial", gpu="prefer"):
+                    results.append(result)
+                    print "%-32s %8d %10.2f s %10.1f/s" % (result["name"], args.prefer_size, result["seconds"],
+                                                            result["per_second"])
+        if not args.skip_generate:
+            for n in [int(x) for x in args.grid_sizes.split(",")]:
+                for size in [int(x) for x in args.template_sizes.split(",")]:
+                    for workers, dry_run in [(0, True), (1, False), (8, False)]:
+                        results.append(bench_generate(work_dir, n, size, workers=workers, dry_run=dry_run))
+                        print "%-32s %8d %10.2f s %10.1f/s" % (results[-1]["name"], results[-1]["n"],
+                                                                results[-1]["seconds"],
+                                                                results[-1]["per_second"])
+        if not args.skip_startup:
+            startup, overhead = measure_startup()
+            results.append({"name": "startup", "n": 1, "seconds": startup, "per_second": 1 / startup,
+                            "overhead": overhead})
+            print "%-32s %8d %10.3f s %10.1f/s" % ("startup", 1, startup, 1 / startup)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {"commit": git_commit(),
+              "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "parameters": {"latency": args.latency, "contention": args.contention,
+                             "failure_rate": args.failure_rate},
+              "results": results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+            f.write("\n")
+    if args.compare:
+        compare(args.compare, report)
+
+
+if __name__ == '__main__':
+    main()
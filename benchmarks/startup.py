@@ -0,0 +1,75 @@
+"""Measures the startup time of the submit command and checks it against a limit.
+
+The submit command is run thousands of times from scripts and jobs, so it must not import heavy modules.
+This script runs "python -c 'import submit.jobsubmitter'" repeatedly and compares the median time with the
+median time of an empty interpreter. It fails if the overhead exceeds the limit or if a module that the
+command does not need, like numpy, is imported.
+
+Usage:
+    python benchmarks/startup.py --max-overhead-ms 100
+"""
+import os
+import os.path
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules the submit command must not import at startup
+forbidden_modules = ["numpy"]
+
+import_statement = "import submit.jobsubmitter"
+
+
+def median_time(code, repeat):
+    """Returns the median wall time in seconds of running code in a new interpreter."""
+    env = dict(os.environ, PYTHONPATH=repo_dir + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        subprocess.check_call([sys.executable, "-c", code], env=env)
+        times.append(time.time() - start)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def imported_modules():
+    """Returns the names of the forbidden modules that are imported at startup."""
+    env = dict(os.environ, PYTHONPATH=repo_dir + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    code = "import sys; %s; print(' '.join(m for m in %r if m in sys.modules))" % (import_statement,
+                                                                                  forbidden_modules)
+    return subprocess.check_output([sys.executable, "-c", code], env=env).split()
+
+
+def measure_startup(repeat=20):
+    """Returns the startup time and its overhead over an empty interpreter in seconds."""
+    baseline = median_time("pass", repeat)
+    startup = median_time(import_statement, repeat)
+    return startup, startup - baseline
+
+
+def main():
+    arg_parser = ArgumentParser(description="Check the startup time of the submit command.")
+    arg_parser.add_argument("--repeat", type=int, default=20, help="number of interpreter starts to measure")
+    arg_parser.add_argument("--max-overhead-ms", type=float, default=100.0,
+                            help="maximum time in ms that importing the command may add to interpreter startup")
+    args = arg_parser.parse_args()
+
+    failed = False
+    modules = imported_modules()
+    if modules:
+        print "imported at startup: %s" % ", ".join(modules)
+        failed = True
+
+    startup, overhead = measure_startup(args.repeat)
+    print "startup %.1f ms, overhead %.1f ms (limit %.1f ms)" % (startup * 1000, overhead * 1000,
+                                                                args.max_overhead_ms)
+    if overhead * 1000 > args.max_overhead_ms:
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-import gridsearch as gs
-
-gridsearch = gs.gridsearch
-remove_index_dirs = gs.remove_index_dirs
+import gridsearch as gs
+
+gridsearch = gs.gridsearch
+remove_index_dirs = gs.remove_index_dirs
@@ -0,0 +1,249 @@
+import errno
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from argparse import ArgumentParser
+
+from manifest import Manifest
+from status import job_ids_of, query_squeue, scan_markers
+
+# name of the directory that receives directories to delete, created next to them
+trash_name = ".submit-trash"
+
+# maximum number of job ids passed to one scancel call
+scancel_batch = 5000
+
+
+class CleanError(Exception):
+    pass
+
+
+def live_job_ids(statuses, manifest=None, user=None):
+    """Returns the ids of the queued or running jobs of the given directories. The ids are taken from the
+    _running markers and the manifest and checked against one squeue call. If squeue fails, all ids of
+    _running markers are returned."""
+    marker_ids = []
+    recorded_ids = []
+    for status in statuses:
+        if status.running_id:
+            marker_ids.append(status.running_id)
+        if manifest is not None:
+            recorded_ids += job_ids_of(manifest.get(status.directory))
+    try:
+        queued = query_squeue(user)
+    except (OSError, subprocess.CalledProcessError):
+        return sorted(set(marker_ids))
+    return sorted(set(job_id for job_id in marker_ids + recorded_ids if job_id in queued))
+
+
+def shared_job_ids(job_ids, directories, manifest):
+    """Returns the ids among job_ids that the manifest also records for directories other than the given
+    ones. Canceling such a job, e.g. a packed job, would also stop the other directories it runs."""
+    if manifest is None:
+        return []
+    keys = set(Manifest.key(directory) for directory in directories)
+    job_directories = manifest.job_directories()
+    return [job_id for job_id in job_ids if any(key not in keys for key in job_directories.get(job_id, []))]
+
+
+def cancel_jobs(job_ids):
+    """Cancels the given jobs with as few scancel calls as possible."""
+    for start in range(0, len(job_ids), scancel_batch):
+        try:
+            subprocess.check_output(["scancel"] + job_ids[start:start + scancel_batch])
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise CleanError("scancel failed: %s" % e)
+
+
+def wait_for_jobs(job_ids, timeout, user=None, interval=1.0):
+    """Waits until none of the given jobs is queued anymore. scancel only signals the jobs, which may still
+    write into their directories while they terminate."""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            queued = query_squeue(user)
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise CleanError("cannot check whether the canceled jobs terminated: %s" % e)
+        remaining = [job_id for job_id in job_ids if job_id in queued]
+        if not remaining:
+            return
+        if time.time() >= deadline:
+            raise CleanError("%d canceled jobs did not terminate within %g s: %s" %
+                             (len(remaining), timeout, " ".join(remaining[:10])))
+        time.sleep(interval)
+
+
+def move_to_trash(directory):
+    """Renames the directory into the trash directory of its parent and returns the new path.
+    Returns the original path if it cannot be renamed, e.g. because it is a mount point."""
+    parent = os.path.dirname(os.path.abspath(directory))
+    trash_root = os.path.join(parent, trash_name)
+    try:
+        os.mkdir(trash_root)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            return directory
+    try:
+        trash = tempfile.mkdtemp(prefix=os.path.basename(os.path.abspath(directory)) + "-", dir=trash_root)
+        os.rename(directory, os.path.join(trash, "dir"))
+    except OSError:
+        return directory
+    return trash
+
+
+def remove_tree(path):
+    """Removes the directory tree at path and, if it is the last entry, the trash directory containing it."""
+    shutil.rmtree(path, ignore_errors=True)
+    parent = os.path.dirname(os.path.abspath(path))
+    if os.path.basename(parent) == trash_name:
+        try:
+            os.rmdir(parent)
+        except OSError:
+            pass
+
+
+class CleanResult(object):
+    def __init__(self):
+        self.directories = []
+        self.job_ids = []
+        self.shared_ids = []
+        self.trash = []
+        self.missing = []
+
+
+def clean_directories(directories, manifest=None, jobs=16, dry_run=False, background=False, cancel=True,
+                      cancel_timeout=60.0, user=None, progress=None):
+    """Cancels the jobs of the given directories and deletes them.
+
+    The live jobs are found like in live_job_ids and canceled with one scancel call. Pending jobs have no
+    _running marker and are only found if manifest is given. Jobs that the manifest also records for
+    directories that are not deleted, like packed jobs, are not canceled but listed in shared_ids. Deletion starts once squeue does not list the
+    canceled jobs anymore; if they are still listed after cancel_timeout seconds, a CleanError is raised and
+    nothing is deleted. Each directory is renamed into a .submit-trash directory next to it, which frees its
+    name immediately, and the trash
+    is deleted using jobs threads. If background is True, the trash is deleted by a detached rm process
+    instead. progress(done, total) is called after each deleted directory. Records of the directories are
+    removed from the manifest. If dry_run is True, nothing is canceled or deleted.
+    Returns a CleanResult."""
+    result = CleanResult()
+    statuses = scan_markers(directories, jobs)
+    for status in statuses:
+        if status.state == "missing":
+            result.missing.append(status.directory)
+        else:
+            result.directories.append(status.directory)
+    present = [status for status in statuses if status.state != "missing"]
+
+    if cancel:
+        job_ids = live_job_ids(present, manifest, user)
+        result.shared_ids = shared_job_ids(job_ids, result.directories, manifest)
+        result.job_ids = [job_id for job_id in job_ids if job_id not in result.shared_ids]
+    if dry_run:
+        return result
+    if result.job_ids:
+        cancel_jobs(result.job_ids)
+        wait_for_jobs(result.job_ids, cancel_timeout, user)
+
+    result.trash = map_threads(move_to_trash, result.directories, jobs)
+    if manifest is not None:
+        for directory in result.directories:
+            manifest.remove(directory)
+
+    if background:
+        with open(os.devnull, 'w') as devnull:
+            subprocess.Popen(["rm", "-rf"] + result.trash, stdin=devnull, stdout=devnull, stderr=devnull,
+                             close_fds=True, preexec_fn=os.setsid)
+        return result
+
+    lock = threading.Lock()
+    done = [0]
+
+    def remove(path):
+        remove_tree(path)
+        with lock:
+            done[0] += 1
+            if progress is not None:
+                progress(done[0], len(result.trash))
+
+    map_threads(remove, result.trash, jobs)
+    return result
+
+
+def map_threads(func, items, jobs):
+    """Applies func to all items using jobs threads and returns the results in order."""
+    if jobs <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(jobs)
+    try:
+        return pool.map(func, items, chunksize=16)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def run_clean(argv):
+    arg_parser = ArgumentParser(prog="submit clean",
+                                description="Cancel the jobs of directories and delete them.")
+    arg_parser.add_argument("directories", metavar="directory", nargs='+',
+                            help="directories to delete")
+    arg_parser.add_argument("--dry-run", "-n", action='store_true',
+                            help="only show the jobs that would be canceled and the directories that would be deleted")
+    arg_parser.add_argument("--background", "-b", action='store_true',
+                            help="delete the renamed directories in a background process and return immediately")
+    arg_parser.add_argument("--no-cancel", action='store_true',
+                            help="do not cancel the jobs of the directories")
+    arg_parser.add_argument("--cancel-timeout", type=float, default=60.0,
+                            help="seconds to wait for canceled jobs to terminate before giving up")
+    arg_parser.add_argument("--jobs", "-j", type=int, default=16,
+                            help="number of threads that scan and delete directories")
+    arg_parser.add_argument("--state-dir", default=".submit",
+                            help="directory containing the manifest")
+    args = arg_parser.parse_args(argv)
+
+    manifest = Manifest(os.path.join(args.state_dir, "manifest.json"))
+    start = time.time()
+    last_report = [start]
+
+    def progress(done, total):
+        now = time.time()
+        if now - last_report[0] >= 1.0 or done == total:
+            last_report[0] = now
+            sys.stdout.write("\rdeleted %d of %d directories" % (done, total))
+            if done == total:
+                sys.stdout.write("\n")
+            sys.stdout.flush()
+
+    try:
+        result = clean_directories(args.directories, manifest=manifest, jobs=args.jobs, dry_run=args.dry_run,
+                                   background=args.background, cancel=not args.no_cancel,
+                                   cancel_timeout=args.cancel_timeout, progress=progress)
+    except CleanError as e:
+        print "%s, no directories were deleted" % e.message
+        sys.exit(1)
+    finally:
+        manifest.save()
+
+    if result.missing:
+        print "%d directories do not exist" % len(result.missing)
+    if result.shared_ids:
+        print "not canceling %d jobs that also run other directories: %s" % (len(result.shared_ids),
+                                                                            " ".join(result.shared_ids))
+    if args.dry_run:
+        if result.job_ids:
+            print "would cancel %d jobs: %s" % (len(result.job_ids), " ".join(result.job_ids))
+        for directory in result.directories:
+            print "would delete %s" % directory
+        return
+    if result.job_ids:
+        print "canceled %d jobs" % len(result.job_ids)
+    if args.background:
+        print "deleting %d directories in the background" % len(result.directories)
+    else:
+        print "deleted %d directories in %.1f s" % (len(result.directories), time.time() - start)
@@ -1,152 +1,616 @@
-from argparse import ArgumentParser
-import logging
-import os
-import glob
-import numpy as np
-import re
-import shutil
-from warnings import warn
-
-log = logging.getLogger("gridsearch")
-logging.basicConfig(level=logging.DEBUG)
-
-
-class GridSearchError(Exception):
-    pass
-
-
-class GridSearch(object):
-    predefined_parameters = ["CFG_INDEX"]
-
-    def __init__(self, name, template, parameter_ranges):
-        self._name = name
-        self._template = template
-        self._parameter_ranges = self._parse_parameters(parameter_ranges)
-
-        log.debug("parsed parameters: %s" % str(self._parameter_ranges))
-
-        self._check_parameters()
-
-    def _parse_parameters(self, para_strs):
-        parameters = {}
-        for p, rng_spec in para_strs.iteritems():
-            try:
-                if isinstance(rng_spec, basestring):
-                    val = self._parse_rng_str(rng_spec)
-                else:
-                    val = []
-                    for e in rng_spec:
-                        if isinstance(e, basestring):
-                            val.extend(self._parse_rng_str(e))
-                        else:
-                            val.append(e)
-                parameters[p.upper()] = val
-            except ValueError as e:
-                log.debug("inner exception:" + str(e))
-                raise GridSearchError("could not parse parameter %s: %s" % (p, e.message))
-        return parameters
-
-    def _parse_value_str(self, value_str):
-        values = []
-        for rng_str in value_str.split(","):
-            values.extend(self._parse_rng_str(rng_str))
-        return values
-
-    def _parse_rng_str(self, rng_str):
-        if ":" in rng_str:
-            rng_parts = rng_str.split(":")
-            if len(rng_parts) == 3:
-                start = float(rng_parts[0])
-                step = float(rng_parts[1])
-                end = float(rng_parts[2])
-            elif len(rng_parts) == 2:
-                start = float(rng_parts[0])
-                step = 1
-                end = float(rng_parts[1])
-            else:
-                raise ValueError("range specification %s is not recognized" % rng_str)
-            logging.debug("Range string %s parsed as: start=%g step=%g end=%g" %
-                          (rng_str, start, step, end))
-            return np.arange(start, end + step/100., step)
-        else:
-            try:
-                return [float(rng_str)]
-            except ValueError:
-                return [rng_str]
-            except TypeError:
-                return [rng_str]
-
-    def _get_used_parameters(self):
-        params = []
-        for m in re.finditer(r"\$(\w+)\$", self._template + " " + self._name):
-            params.append(m.group(1).upper())
-        return set(params)
-
-    def _check_parameters(self):
-        used_params = self._get_used_parameters()
-        used_params |= set(self.predefined_parameters)
-        specified_params = set(self._parameter_ranges.keys())
-        specified_params |= set(self.predefined_parameters)
-        used_but_not_specified = used_params - specified_params
-        if used_but_not_specified:
-            raise GridSearch("parameter(s) %s used in template but no range was specified" % str(used_but_not_specified))
-        specified_but_not_used = specified_params - used_params
-        if specified_but_not_used:
-            warn("parameter(s) %s specified but not used in template" % str(specified_but_not_used))
-
-    def _instantiate(self, template, parameters):
-        inst = template
-        rpl_tag = "###REPLACEMENT_TAG###"
-        for p, val in parameters.iteritems():
-            inst = re.sub(r"\$%s\$" % re.escape(p), rpl_tag, inst, flags=re.IGNORECASE)
-            inst = inst.replace(rpl_tag, str(val))
-        return inst
-
-    def _generate_rec(self, p_rest):
-        if p_rest:
-            p = p_rest[0]
-            for val in self._parameter_ranges[p]:
-                for rest in self._generate_rec(p_rest[1:]):
-                    p_vals = {p: val}
-                    p_vals.update(rest)
-                    yield p_vals
-        else:
-            yield {}
-
-    def generate(self):
-        plist = self._parameter_ranges.keys()
-        cfg_index = 0
-
-        for p_vals in self._generate_rec(plist):
-            cfg_index += 1
-            p_vals["CFG_INDEX"] = "%05d" % cfg_index
-
-            name = self._instantiate(self._name, p_vals)
-            data = self._instantiate(self._template, p_vals)
-
-            dirname, filename = os.path.split(name)
-            try:
-                os.makedirs(dirname)
-            except:
-                pass
-            with open(name, 'w') as f:
-                f.write(data)
-
-
-def gridsearch(name, template, parameter_ranges):
-    GridSearch(name, template, parameter_ranges).generate()
-    # GridSearch(name, template, parameter_ranges)
-
-
-def remove_index_dirs():
-    """Deletes all subfolders of the current directory whose name is an integer number."""
-    for filename in glob.glob("*"):
-        if filename == ".." or filename == ".":
-            continue
-        if os.path.isdir(filename):
-            try:
-                int(filename)
-            except ValueError:
-                continue
-
-            shutil.rmtree(filename)
+from argparse import ArgumentParser
+import errno
+import logging
+import os
+import glob
+import hashlib
+import itertools
+import json
+import math
+import numbers
+import random
+import re
+import tempfile
+import threading
+import time
+from Queue import Queue
+from warnings import warn
+
+log = logging.getLogger("gridsearch")
+
+
+class GridSearchError(Exception):
+    pass
+
+
+class ConfigWriter(object):
+    """Writes configuration files, optionally using a pool of writer threads fed through a bounded queue,
+    so that rendering and file system access overlap.
+    If previous is given, files whose content is unchanged are not written, so that their modification time
+    is kept. previous maps paths to [sha1, mtime, size] as recorded in states by an earlier writer. Files that
+    are not in previous or whose modification time or size changed are compared with the content on disk."""
+
+    def __init__(self, workers=1, atomic=False, dry_run=False, queue_size=1000, progress_interval=10.0,
+                 previous=None):
+        self.workers = workers
+        self.atomic = atomic
+        self.dry_run = dry_run
+        self.progress_interval = progress_interval
+        self.previous = previous
+        self.states = {}
+        self.n_unchanged = 0
+        # the umask can only be read by setting it, which must not happen while writer threads create files
+        self.umask = os.umask(0)
+        os.umask(self.umask)
+
+        self.created_dirs = set()
+        self.names = set()
+        self.lock = threading.Lock()
+        self.error = None
+        self.n_files = 0
+        self.n_bytes = 0
+        self.start_time = time.time()
+        self.last_report = self.start_time
+
+        self.queue = None
+        self.threads = []
+        if workers > 1 and not dry_run:
+            self.queue = Queue(queue_size)
+            for _ in range(workers):
+                thread = threading.Thread(target=self._worker)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def write(self, path, data):
+        """Writes data to the file at path or queues it for writing."""
+        if self.error:
+            raise self.error
+        if self.dry_run:
+            if path in self.names:
+                raise GridSearchError("file %s is generated more than once" % path)
+            self.names.add(path)
+            self._count(data)
+        elif self.queue is not None:
+            self.queue.put((path, data))
+        else:
+            self._write_file(path, data)
+
+    def close(self):
+        """Waits until all queued files are written and reports the throughput."""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        if self.error:
+            raise self.error
+        duration = time.time() - self.start_time
+        log.info("%s %d files (%d bytes) in %.1f s (%.0f files/s)" %
+                 ("validated" if self.dry_run else "wrote", self.n_files, self.n_bytes, duration,
+                  self.n_files / max(duration, 1e-6)))
+        if self.previous is not None and not self.dry_run:
+            log.info("kept %d unchanged files" % self.n_unchanged)
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error:
+                continue
+            try:
+                self._write_file(*item)
+            except (IOError, OSError) as e:
+                self.error = GridSearchError("cannot write %s: %s" % (item[0], e))
+            except Exception as e:
+                # the thread must keep draining the queue, otherwise write and close block forever
+                self.error = e
+
+    def _make_dir(self, dirname):
+        with self.lock:
+            if dirname in self.created_dirs:
+                return
+        try:
+            os.makedirs(dirname)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        with self.lock:
+            self.created_dirs.add(dirname)
+
+    def _unchanged(self, path, data, digest):
+        """Returns whether the file at path has the given content."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        if st.st_size != len(data):
+            return False
+        previous = self.previous.get(path)
+        if previous is not None and previous == [digest, st.st_mtime, st.st_size]:
+            return True
+        with open(path, 'r') as f:
+            return f.read() == data
+
+    def _write_file(self, path, data):
+        if self.previous is not None:
+            digest = hashlib.sha1(data).hexdigest()
+            if self._unchanged(path, data, digest):
+                st = os.stat(path)
+                with self.lock:
+                    self.states[path] = [digest, st.st_mtime, st.st_size]
+                    self.n_unchanged += 1
+                return
+
+        dirname = os.path.dirname(path)
+        if dirname:
+            self._make_dir(dirname)
+        if self.atomic:
+            fd, tmp_path = tempfile.mkstemp(prefix="." + os.path.basename(path) + ".", dir=dirname or ".")
+            with os.fdopen(fd, 'w') as f:
+                f.write(data)
+            os.chmod(tmp_path, 0o666 & ~self.umask)
+            os.rename(tmp_path, path)
+        else:
+            with open(path, 'w') as f:
+                f.write(data)
+        if self.previous is not None:
+            st = os.stat(path)
+            with self.lock:
+                self.states[path] = [digest, st.st_mtime, st.st_size]
+        self._count(data)
+
+    def _count(self, data):
+        with self.lock:
+            self.n_files += 1
+            self.n_bytes += len(data)
+            now = time.time()
+            if self.progress_interval and now - self.last_report >= self.progress_interval:
+                self.last_report = now
+                log.info("%d files %s (%.0f files/s)" %
+                         (self.n_files, "validated" if self.dry_run else "written",
+                          self.n_files / (now - self.start_time)))
+
+
+class Template(object):
+    """Template with case-insensitive $NAME$ placeholders.
+    The template is split into literal text and slots once, so that rendering only requires a single join.
+    Values are inserted as they are, i.e. placeholders within values are not expanded."""
+
+    def __init__(self, text, names):
+        """names is the list of parameter names in the order in which render expects their values."""
+        self.parts = []
+        self.slots = []
+        pos = 0
+        if names:
+            alternatives = "|".join(re.escape(n) for n in sorted(names, key=len, reverse=True))
+            pattern = re.compile(r"\$(%s)\$" % alternatives, re.IGNORECASE)
+            index_of = dict((n.upper(), i) for i, n in enumerate(names))
+            for m in pattern.finditer(text):
+                self.parts.append(text[pos:m.start()])
+                self.slots.append((len(self.parts), index_of[m.group(1).upper()]))
+                self.parts.append(None)
+                pos = m.end()
+        self.parts.append(text[pos:])
+
+    def render(self, values):
+        """Renders the template using the given sequence of formatted values ordered like names."""
+        parts = self.parts[:]
+        for pos, index in self.slots:
+            parts[pos] = values[index]
+        return "".join(parts)
+
+
+class ParameterProduct(object):
+    """Cartesian product of parameter ranges.
+    Points are ordered like nested loops with the first parameter as the outermost loop.
+    Point i of the product has the configuration index i + 1."""
+
+    def __init__(self, names, ranges):
+        self.names = list(names)
+        self.ranges = [list(r) for r in ranges]
+
+        # stride of each parameter in the flat index
+        self.strides = []
+        size = 1
+        for rng in reversed(self.ranges):
+            self.strides.insert(0, size)
+            size *= len(rng)
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def value_indices(self, index):
+        """Returns the index into the range of each parameter for the point with the given index."""
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("point index out of range")
+        return tuple((index // stride) % len(rng) for stride, rng in zip(self.strides, self.ranges))
+
+    def index_of(self, value_indices):
+        """Returns the index of the point with the given value indices."""
+        return sum(i * stride for i, stride in zip(value_indices, self.strides))
+
+    def values(self, index):
+        """Returns the parameter values of the point with the given index as a tuple ordered like names."""
+        return tuple(rng[i] for rng, i in zip(self.ranges, self.value_indices(index)))
+
+    def __getitem__(self, index):
+        return dict(zip(self.names, self.values(index)))
+
+    def iter_values(self):
+        """Yields the parameter values of all points as tuples ordered like names."""
+        return itertools.product(*self.ranges)
+
+    def __iter__(self):
+        names = self.names
+        for values in self.iter_values():
+            yield dict(zip(names, values))
+
+
+# Sobol direction numbers (s, a, m_1 ... m_s) for dimensions 2 to 21 from
+# S. Joe and F. Y. Kuo, "Constructing Sobol sequences with better two-dimensional projections", 2008.
+SOBOL_DIRECTIONS = [
+    (1, 0, [1]),
+    (2, 1, [1, 3]),
+    (3, 1, [1, 3, 1]),
+    (3, 2, [1, 1, 1]),
+    (4, 1, [1, 1, 3, 3]),
+    (4, 4, [1, 3, 5, 13]),
+    (5, 2, [1, 1, 5, 5, 17]),
+    (5, 4, [1, 1, 5, 5, 5]),
+    (5, 7, [1, 1, 7, 11, 19]),
+    (5, 11, [1, 1, 5, 1, 1]),
+    (5, 13, [1, 1, 1, 3, 11]),
+    (5, 14, [1, 3, 5, 5, 31]),
+    (6, 1, [1, 3, 3, 9, 7, 49]),
+    (6, 13, [1, 1, 1, 15, 21, 21]),
+    (6, 16, [1, 3, 1, 13, 27, 49]),
+    (6, 19, [1, 1, 1, 15, 7, 5]),
+    (6, 22, [1, 3, 1, 15, 13, 25]),
+    (6, 25, [1, 1, 5, 5, 19, 61]),
+    (7, 1, [1, 3, 7, 11, 23, 15, 103]),
+    (7, 4, [1, 3, 7, 13, 13, 15, 69]),
+]
+SOBOL_BITS = 32
+
+sampling_strategies = ["random", "lhs", "sobol"]
+
+
+def _sobol_vectors(dim):
+    """Returns the direction vectors of the given Sobol dimension (0-based)."""
+    if dim == 0:
+        return [1 << (SOBOL_BITS - i - 1) for i in range(SOBOL_BITS)]
+    s, a, m = SOBOL_DIRECTIONS[dim - 1]
+    v = []
+    for i in range(SOBOL_BITS):
+        if i < s:
+            v.append(m[i] << (SOBOL_BITS - i - 1))
+        else:
+            x = v[i - s] ^ (v[i - s] >> s)
+            for k in range(1, s):
+                if (a >> (s - 1 - k)) & 1:
+                    x ^= v[i - k]
+            v.append(x)
+    return v
+
+
+def _sobol_points(n_dims, rnd):
+    """Yields an infinite Sobol sequence in the unit cube, randomized by a digital shift drawn from rnd."""
+    if n_dims > len(SOBOL_DIRECTIONS) + 1:
+        raise GridSearchError("sobol sampling supports at most %d parameters" % (len(SOBOL_DIRECTIONS) + 1))
+    vectors = [_sobol_vectors(d) for d in range(n_dims)]
+    x = [rnd.getrandbits(SOBOL_BITS) for _ in range(n_dims)]
+    scale = 1.0 / (1 << SOBOL_BITS)
+    n = 0
+    while True:
+        yield [xd * scale for xd in x]
+        # Gray code order: flip the direction vector of the lowest zero bit of n
+        c = 0
+        while (n >> c) & 1:
+            c += 1
+        n += 1
+        if c >= SOBOL_BITS:
+            return
+        x = [xd ^ vd[c] for xd, vd in zip(x, vectors)]
+
+
+def _lhs_points(n_dims, n_points, rnd):
+    """Yields a Latin hypercube sample of n_points in the unit cube followed by uniform random points."""
+    strata = []
+    for _ in range(n_dims):
+        perm = list(range(n_points))
+        rnd.shuffle(perm)
+        strata.append(perm)
+    for k in range(n_points):
+        yield [(strata[d][k] + rnd.random()) / n_points for d in range(n_dims)]
+    while True:
+        yield [rnd.random() for _ in range(n_dims)]
+
+
+def sample_indices(product, sampling, budget, seed=0):
+    """Yields up to budget distinct point indices of the ParameterProduct drawn using the specified strategy.
+
+    random: uniformly random points
+    lhs:    Latin hypercube over the value ranges of all parameters
+    sobol:  scrambled Sobol sequence over the value ranges of all parameters
+
+    The draws only depend on the seed, thus for random and sobol sampling a sample with a larger budget
+    extends the sample with a smaller budget. Latin hypercube samples of different budgets are not nested.
+    If the budget is at least the size of the product, all points are returned in order."""
+    if sampling not in sampling_strategies:
+        raise GridSearchError("sampling strategy %s not recognized" % sampling)
+    size = len(product)
+    if budget >= size:
+        for index in xrange(size):
+            yield index
+        return
+
+    rnd = random.Random(seed)
+    n_dims = len(product.ranges)
+    if sampling == "sobol":
+        points = _sobol_points(n_dims, rnd)
+    elif sampling == "lhs":
+        points = _lhs_points(n_dims, budget, rnd)
+    else:
+        points = None
+
+    seen = set()
+    while len(seen) < budget:
+        if points is not None:
+            try:
+                u = next(points)
+            except StopIteration:
+                points = None
+                continue
+            index = product.index_of([int(ud * len(rng)) for ud, rng in zip(u, product.ranges)])
+        else:
+            index = rnd.randrange(size)
+        if index not in seen:
+            seen.add(index)
+            yield index
+
+
+class RangeValue(float):
+    """Value of a parameter range, formatted with repr like the numpy floats that ranges used to consist of."""
+    __str__ = float.__repr__
+
+
+def arange(start, stop, step):
+    """Returns the values start, start + step, ... before stop computed like numpy.arange."""
+    if step == 0:
+        raise ValueError("step must not be zero")
+    n = int(math.ceil((stop - start) / step))
+    # numpy sets the first value to start and fills the rest using the difference of the first two values
+    delta = (start + step) - start
+    return [RangeValue(start if i == 0 else start + i * delta) for i in range(max(n, 0))]
+
+
+def json_value(value):
+    """Converts a parameter value to a type that can be written as JSON."""
+    if isinstance(value, numbers.Number):
+        return float(value)
+    return str(value)
+
+
+class GridSearch(object):
+    predefined_parameters = ["CFG_INDEX"]
+
+    def __init__(self, name, template, parameter_ranges):
+        self._name = name
+        self._template = template
+        self._parameter_ranges = self._parse_parameters(parameter_ranges)
+
+        log.debug("parsed parameters: %s" % str(self._parameter_ranges))
+
+        self._check_parameters()
+        self.orphans = []
+
+    def _parse_parameters(self, para_strs):
+        parameters = {}
+        for p, rng_spec in para_strs.iteritems():
+            try:
+                if isinstance(rng_spec, basestring):
+                    val = self._parse_rng_str(rng_spec)
+                else:
+                    val = []
+                    for e in rng_spec:
+                        if isinstance(e, basestring):
+                            val.extend(self._parse_rng_str(e))
+                        else:
+                            val.append(e)
+                parameters[p.upper()] = val
+            except ValueError as e:
+                log.debug("inner exception:" + str(e))
+                raise GridSearchError("could not parse parameter %s: %s" % (p, e.message))
+        return parameters
+
+    def _parse_value_str(self, value_str):
+        values = []
+        for rng_str in value_str.split(","):
+            values.extend(self._parse_rng_str(rng_str))
+        return values
+
+    def _parse_rng_str(self, rng_str):
+        if ":" in rng_str:
+            rng_parts = rng_str.split(":")
+            if len(rng_parts) == 3:
+                start = float(rng_parts[0])
+                step = float(rng_parts[1])
+                end = float(rng_parts[2])
+            elif len(rng_parts) == 2:
+                start = float(rng_parts[0])
+                step = 1
+                end = float(rng_parts[1])
+            else:
+                raise ValueError("range specification %s is not recognized" % rng_str)
+            log.debug("Range string %s parsed as: start=%g step=%g end=%g" %
+                      (rng_str, start, step, end))
+            return arange(start, end + step/100., step)
+        else:
+            try:
+                return [float(rng_str)]
+            except ValueError:
+                return [rng_str]
+            except TypeError:
+                return [rng_str]
+
+    def _get_used_parameters(self):
+        params = []
+        for m in re.finditer(r"\$(\w+)\$", self._template + " " + self._name):
+            params.append(m.group(1).upper())
+        return set(params)
+
+    def _check_parameters(self):
+        used_params = self._get_used_parameters()
+        used_params |= set(self.predefined_parameters)
+        specified_params = set(self._parameter_ranges.keys())
+        specified_params |= set(self.predefined_parameters)
+        used_but_not_specified = used_params - specified_params
+        if used_but_not_specified:
+            raise GridSearch("parameter(s) %s used in template but no range was specified" % str(used_but_not_specified))
+        specified_but_not_used = specified_params - used_params
+        if specified_but_not_used:
+            warn("parameter(s) %s specified but not used in template" % str(specified_but_not_used))
+
+    def product(self):
+        """Returns the cartesian product of all parameter ranges."""
+        plist = self._parameter_ranges.keys()
+        return ParameterProduct(plist, [self._parameter_ranges[p] for p in plist])
+
+    def generate(self, workers=1, atomic=False, dry_run=False, progress_interval=10.0,
+                 sampling=None, budget=None, seed=0, dedupe=False, record_parameters=False, incremental=False):
+        """Generates the configuration files of all points and returns the number of points.
+        workers is the number of threads that write files. If atomic is True, each file is written to
+        a temporary file first and renamed into place. If dry_run is True, the points are only rendered,
+        counted and checked for duplicate file names.
+        If sampling is specified, only budget points drawn by the given strategy are generated
+        (see sample_indices). A sampled point keeps the CFG_INDEX it has in the full grid.
+        If dedupe is True, points whose configuration file would be identical to that of an earlier point
+        apart from CFG_INDEX are skipped, e.g. points that only differ in parameters the template does not use.
+        If record_parameters is True, the parameter values of each point are written as JSON to a _params file
+        next to its configuration file, which submit --auto-resources uses to predict time and memory.
+        If incremental is True, files whose content did not change are not written again, so that submit --update
+        does not resubmit finished points, and the hashes of all files are recorded in the grid manifest
+        (see manifest_path). Directories of files of an earlier incremental run that are not part of the grid
+        anymore are stored in the orphans attribute and reported until they are deleted."""
+        if sampling is not None and budget is None:
+            raise GridSearchError("a budget must be specified for sampling")
+        previous = None
+        if incremental and not dry_run:
+            previous = self._load_manifest()
+        writer = ConfigWriter(workers=workers, atomic=atomic, dry_run=dry_run,
+                              progress_interval=progress_interval, previous=previous)
+        product = self.product()
+        names = product.names + ["CFG_INDEX"]
+        name_template = Template(self._name, names)
+        data_template = Template(self._template, names)
+
+        # format each value once instead of once per point
+        formatted = ParameterProduct(product.names, [[str(v) for v in rng] for rng in product.ranges])
+
+        if sampling is None:
+            points = enumerate(formatted.iter_values(), 1)
+        else:
+            points = ((index + 1, formatted.values(index))
+                      for index in sample_indices(product, sampling, budget, seed))
+
+        if dedupe:
+            # values that end up in the configuration file, CFG_INDEX is the last value
+            data_indices = sorted(set(index for pos, index in data_template.slots if index < len(product.names)))
+            seen = set()
+
+        n_points = 0
+        n_duplicates = 0
+        try:
+            for cfg_index, values in points:
+                if dedupe:
+                    key = tuple(values[i] for i in data_indices)
+                    if key in seen:
+                        n_duplicates += 1
+                        continue
+                    seen.add(key)
+                values += ("%05d" % cfg_index,)
+
+                name = name_template.render(values)
+                data = data_template.render(values)
+                writer.write(name, data)
+                if record_parameters:
+                    parameters = dict((n, json_value(v)) for n, v in zip(product.names, product.values(cfg_index - 1)))
+                    writer.write(os.path.join(os.path.dirname(name), "_params"), json.dumps(parameters, sort_keys=True))
+                n_points += 1
+        finally:
+            writer.close()
+        if n_duplicates:
+            log.info("skipped %d duplicate points" % n_duplicates)
+        if previous is not None:
+            # orphaned files stay in the manifest until they are deleted, so that they are reported again
+            states = dict(writer.states)
+            for path, state in previous.items():
+                if path not in states and os.path.exists(path):
+                    states[path] = state
+            self._save_manifest(states)
+            current = set(os.path.dirname(path) for path in writer.states)
+            self.orphans = sorted(set(str(os.path.dirname(path)) for path in states) - current)
+            if self.orphans:
+                log.warning("%d directories of an earlier generation are not part of the grid anymore: %s" %
+                            (len(self.orphans), ", ".join(self.orphans[:10]) +
+                             (", ..." if len(self.orphans) > 10 else "")))
+        return n_points
+
+    def manifest_path(self):
+        """Returns the path of the file that records the generated files of this grid. It is stored in the
+        directory that contains all generated files and named after a hash of the file name template."""
+        root = os.path.dirname(self._name.split("$")[0]) or "."
+        return os.path.join(root, ".gridsearch-%s.json" % hashlib.sha1(self._name).hexdigest()[:12])
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path(), 'r') as f:
+                return json.load(f)["files"]
+        except (IOError, ValueError, KeyError):
+            return {}
+
+    def _save_manifest(self, states):
+        path = self.manifest_path()
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        fd, tmp_path = tempfile.mkstemp(prefix=".gridsearch-", dir=dirname)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({"name": self._name, "files": states}, f)
+        os.rename(tmp_path, path)
+
+
+def gridsearch(name, template, parameter_ranges, **kwargs):
+    """Generates a configuration file for each point of the grid. See GridSearch.generate for kwargs."""
+    logging.basicConfig(level=logging.DEBUG)
+    return GridSearch(name, template, parameter_ranges).generate(**kwargs)
+    # GridSearch(name, template, parameter_ranges)
+
+
+def remove_index_dirs(state_dir=".submit", **kwargs):
+    """Deletes all subfolders of the current directory whose name is an integer number after canceling
+    their jobs. Pending jobs are found using the manifest in state_dir.
+    See clean.clean_directories for kwargs."""
+    from clean import clean_directories
+    from manifest import Manifest
+    directories = []
+    for filename in glob.glob("*"):
+        if filename == ".." or filename == ".":
+            continue
+        if os.path.isdir(filename):
+            try:
+                int(filename)
+            except ValueError:
+                continue
+
+            directories.append(filename)
+    manifest = kwargs.pop("manifest", None) or Manifest(os.path.join(state_dir, "manifest.json"))
+    try:
+        return clean_directories(directories, manifest=manifest, **kwargs)
+    finally:
+        manifest.save()
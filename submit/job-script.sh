@@ -6,7 +6,16 @@ function get_job_state {
     scontrol show job "$1" | grep JobState | cut -d" " -f4 | cut -d = -f2
 }
 
+function stage_out {
+    if [ "$workdir" != "$cfg" ] ; then
+        echo "Staging out $workdir"
+        "$stage_python" "$stage_helper" out "$cfg" "$workdir"
+        workdir="$cfg"
+    fi
+}
+
 function on_sigterm {
+    stage_out
     rm -f "$cfg/_running"
     exit 1
 }
@@ -18,6 +27,17 @@ xpu_twin="$4"
 prolog="$5"
 shift 5
 
+# job arrays receive an index file instead of a directory,
+# line i contains the directory and log file of array task i
+if [ "$SLURM_ARRAY_TASK_ID" != "" ] && [ -f "$cfg" ] ; then
+    index="$cfg"
+    entry=$(sed -n "$((SLURM_ARRAY_TASK_ID + 1))p" "$index")
+    cfg="${entry%%	*}"
+    log_path="${entry#*	}"
+    exec >> "$log_path" 2>&1
+    echo "Array task $SLURM_ARRAY_TASK_ID of $SLURM_ARRAY_JOB_ID from $index"
+fi
+
 echo "Job id is $SLURM_JOB_ID"
 echo "Hostname is $(hostname)"
 echo "Device is $device"
@@ -31,6 +51,11 @@ else
     # handle GPU prefered jobs
     if [ "$xpu_twin" != "0" ] ; then
         if [ "$device" == "gpu" ] ; then
+            # the GPU twin is submitted before its CPU twin and therefore
+            # reads the id of the CPU twin from a file
+            if [ "$xpu_twin" == "-1" ] ; then
+                xpu_twin=$(cat "$cfg/_twin")
+            fi
             # if CPU twin job was already running or completed that it would have
             # canceled this job
             echo "Canceling CPU twin $xpu_twin"
@@ -52,20 +77,34 @@ else
     fi
 fi
 
+workdir="$cfg"
 trap on_sigterm TERM
 rm -f "$cfg/_finished" "$cfg/_failed" "$cfg/_requeued"
 echo $SLURM_JOB_ID > "$cfg/_running"
 
+# copy input files to node-local scratch if requested by the submitter
+if [ -f "$cfg/_stage" ] ; then
+    stage_python=$(sed -n 's/^python //p' "$cfg/_stage")
+    stage_helper=$(sed -n 's/^helper //p' "$cfg/_stage")
+    if staged=$("$stage_python" "$stage_helper" in "$cfg") ; then
+        workdir="$staged"
+        echo "Staged input files to $workdir"
+    else
+        echo "Stage-in failed, running in $cfg"
+    fi
+fi
+
 . "$prolog"
 
 echo
 echo "Execution directory is $(pwd)"
-echo $runner "$cfg" "$@"
+echo $runner "$workdir" "$@"
 echo
 
-srun $runner "$cfg" "$@"
+srun $SUBMIT_SRUN_OPTIONS $runner "$workdir" "$@"
 retval=$?
 
+stage_out
 rm -f "$cfg/_running"
 echo
 echo "Exit code is $retval"
@@ -73,9 +112,15 @@ echo "Exit code is $retval"
 if [ "$retval" == "0" ] ; then
     touch "$cfg/_finished"
 elif [ "$retval" == "9" ] ; then
-    echo "Requeing job..."
     touch "$cfg/_requeued"
-    scontrol requeue $SLURM_JOB_ID
+    if [ "$SUBMIT_PACKED" == "yes" ] ; then
+        # requeuing would restart all directories of the packed job,
+        # the directory is resubmitted by the next run of submit --update
+        echo "Not requeuing packed job"
+    else
+        echo "Requeing job..."
+        scontrol requeue $SLURM_JOB_ID
+    fi
 else
     touch "$cfg/_failed"
 fi
@@ -1,346 +1,1225 @@
-import glob
-import os
-import os.path
-import sys
-import logging
-import re
-
-from argparse import ArgumentParser
-from ConfigParser import ConfigParser
-import subprocess
-
-log = None
-
-
-def arg_split(args, sep=","):
-    return [f.strip() for f in args.split(sep) if len(f) > 0]
-
-
-class SubmissionError(Exception):
-    pass
-
-
-class Configuration(object):
-    def __init__(self, cfg_path):
-        self.cfg_path = cfg_path
-
-        self.runner = None
-        self.input_files = []
-        self.log_file = "output.txt"
-        self.gpu = 'no'
-        self.slurm_options = None
-        self.slurm_options_gpu = None
-        self.slurm_options_cpu = None
-
-        self.parse()
-        self.parse_slurm_options()
-
-    def parse(self):
-        with open(self.cfg_path, 'r') as f:
-            for line in f.readlines():
-                line = line.strip()
-                m = re.match(r"^#\s*SUBMIT:\s*([a-zA-Z\-]+)\s*=\s*(.*)$", line)
-                if m:
-                    name = m.group(1).lower()
-                    value = m.group(2).strip()
-
-                    if name == "runner":
-                        self.runner = value
-                    elif name == "input-files":
-                        self.input_files = arg_split(value)
-                    elif name == "log-file":
-                        self.log_file = value
-                    elif name == "gpu":
-                        value = value.lower()
-                        if value not in ['yes', 'prefer', 'no']:
-                            raise SubmissionError("GPU option %s not recognized" % value)
-                        self.gpu = value
-                    else:
-                        raise SubmissionError("submit option %s in config file not recognized" % name)
-        if not self.runner:
-            raise SubmissionError("required option runner was not specified in configuration file")
-
-    def parse_slurm_options(self):
-        """Reads SBATCH options from the specified configuration file."""
-        self.slurm_options = []
-        self.slurm_options_gpu = []
-        self.slurm_options_cpu = []
-        with open(self.cfg_path, 'r') as f:
-            for line in f.readlines():
-                m = re.match(r"^#\s*SBATCH GPU (.*)$", line)
-                if m is not None:
-                    self.slurm_options_gpu.append(m.group(1).strip())
-                    continue
-
-                m = re.match(r"^#\s*SBATCH CPU (.*)$", line)
-                if m is not None:
-                    self.slurm_options_cpu.append(m.group(1).strip())
-                    continue
-
-                m = re.match(r"^#\s*SBATCH (.*)$", line)
-                if m is not None:
-                    self.slurm_options.append(m.group(1).strip())
-
-
-class JobSubmitter(object):
-    def __init__(self, script=None, cfg_files=[], update=False, retry_failed=False,
-                 log_file=None, slurm_options=None, gpu=None, prolog=None, options=[]):
-        self.script = script
-        self.cfg_files = cfg_files
-        self.update = update
-        self.retry_failed = retry_failed
-        self.log_file = log_file
-        self.slurm_options = slurm_options
-        self.gpu = gpu
-        self.prolog = prolog
-        self.options = options
-
-        log.debug("Using job batch script %s" % self.script)
-        log.debug("Using slurm options: %s" % str(self.slurm_options))
-
-    def find_config_file(self, directory):
-        """Returns the first configuration file in the given directory."""
-        for filename in self.cfg_files:
-            cfg_path = os.path.join(directory, filename)
-            if os.path.exists(cfg_path):
-                return cfg_path, filename
-        return None, None
-
-    def get_mtimes(self, directory, files, ignore_missing=False):
-        """Returns an array of the modification times of the specified files."""
-        mtimes = []
-        for file in files:
-            path = os.path.join(directory, file)
-            if ignore_missing and not os.path.isfile(path):
-                continue
-            else:
-                mtimes.append(os.path.getmtime(path))
-        return mtimes
-
-    def check_file_existance(self, directory, files):
-        """Checks that all specified files exist and raises and exception otherwise."""
-        for file in files:
-            path = os.path.join(directory, file)
-            if not os.path.isfile(path):
-                raise SubmissionError("file %s is missing" % path)
-
-    def submit_job(self, job_name, log_path, opts, runner, cfg, device, xpu_twin):
-        """Submits to SLURM using sbatch and returns the job id."""
-        cmd = ["sbatch", "--job-name=" + job_name, "--output=" + log_path]
-        cmd += opts
-        cmd += [self.script, runner, cfg, device, str(xpu_twin), self.prolog]
-        cmd += self.options
-
-        log.debug("Executing: " + " ".join(cmd))
-        try:
-            output = subprocess.check_output(cmd)
-        except subprocess.CalledProcessError as e:
-            raise SubmissionError("sbatch failed")
-
-        m = re.search("Submitted batch job (\d+)", output)
-        if m:
-            return int(m.group(1))
-        else:
-            return SubmissionError("sbatch failed with unexpected output: " + output)
-
-    def cancel_job(self, job_id):
-        """Cancels the SLURM job with the given id."""
-        retval = subprocess.check_call(["scancel", str(job_id)])
-        if retval != 0:
-            raise SubmissionError("scancel failed for job %d" % job_id)
-
-    def release_job(self, job_id):
-        """Releases the held SLURM job with the given id."""
-        retval = subprocess.check_call(["scontrol", "release", str(job_id)])
-        if retval != 0:
-            raise SubmissionError("scontrol release failed for job %d" % job_id)
-
-    def submit_directory(self, directory):
-        """Submits the given directory to the job scheduler."""
-        if not os.path.isdir(directory):
-            raise SubmissionError("specified path is not a directory")
-
-        cfg_path, cfg_filename = self.find_config_file(directory)
-        if not cfg_path:
-            raise SubmissionError("no config file found for directory %s" % directory)
-        log.debug("Using configuration file %s" % cfg_path)
-        cfg = Configuration(cfg_path)
-        log.debug("parsed configuration: {" +
-                  ", ".join("%s: %s" % item for item in vars(cfg).items()) + "}")
-
-        # log file
-        if self.log_file:
-            log_file = self.log_file
-        else:
-            log_file = cfg.log_file
-        log_path = os.path.join(directory, log_file)
-
-        # input files
-        input_files = cfg.input_files[:]
-        input_files.append(cfg_filename)
-        self.check_file_existance(directory, input_files)
-
-        # check modification times if update is specified
-        if self.update:
-            input_mtimes = self.get_mtimes(directory, input_files, ignore_missing=False)
-            most_recent_input = max(input_mtimes)
-
-            fail_filename = os.path.join(directory, "_failed")
-            if (os.path.exists(fail_filename) and os.path.getmtime(fail_filename) >= most_recent_input and
-                    not self.retry_failed):
-                raise SubmissionError("failed previously")
-
-            finished_filename = os.path.join(directory, "_finished")
-            if os.path.exists(finished_filename) and os.path.getmtime(finished_filename) >= most_recent_input:
-                raise SubmissionError("current")
-
-        # slurm options
-        slurm_options = self.slurm_options[:]
-        slurm_options += cfg.slurm_options
-        cpu_options = slurm_options[:] + cfg.slurm_options_cpu
-        gpu_options = slurm_options[:] + cfg.slurm_options_gpu
-        gpu_options.append("--gres=gpu")
-
-        # gpu
-        if self.gpu:
-            gpu = self.gpu
-        else:
-            gpu = cfg.gpu
-
-        # remove previous log
-        if os.path.exists(log_path):
-            os.unlink(log_path)
-
-        gpu_job_id = None
-        cpu_job_id = None
-
-        if gpu == 'yes':
-            gpu_job_id = self.submit_job(directory, log_path, gpu_options, cfg.runner, directory, 'gpu', 0)
-        elif gpu == 'no':
-            cpu_job_id = self.submit_job(directory, log_path, cpu_options, cfg.runner, directory, 'cpu', 0)
-        elif gpu == 'prefer':
-            cpu_options.append("--hold")
-            gpu_options.append("--hold")
-
-            while True:
-                # submit dummy job to get current slurm job id
-                dummy_id = self.submit_job(directory + "_dummy", log_path, cpu_options, cfg.runner, directory, 'cpu', 0)
-                gpu_job_id = dummy_id + 1
-                cpu_job_id = dummy_id + 2
-                log.debug("Dummy job id is %d, expecting gpu jobid=%d and cpu jobid=%d" %
-                          (dummy_id, gpu_job_id, cpu_job_id))
-
-                gpu_job_id_real = self.submit_job(directory + "(gpu)", log_path, gpu_options,
-                                                  cfg.runner, directory, 'gpu', cpu_job_id)
-                cpu_job_id_real = self.submit_job(directory + "(cpu)", log_path, cpu_options,
-                                                  cfg.runner, directory, 'cpu', gpu_job_id)
-                log.debug("Got gpu jobid=%d and cpu jobid=%d" %
-                          (gpu_job_id_real, cpu_job_id_real))
-
-                self.cancel_job(dummy_id)
-                if gpu_job_id == gpu_job_id_real and cpu_job_id == cpu_job_id_real:
-                    # job id okay. cancel dummy and release real jobs.
-                    log.debug("Got expected jobids.")
-                    self.release_job(gpu_job_id)
-                    self.release_job(cpu_job_id)
-                    break
-                else:
-                    # did not get expected job ids. cancel and retry.
-                    log.debug("Did not get expected jobids. Retrying...")
-                    self.cancel_job(gpu_job_id_real)
-                    self.cancel_job(cpu_job_id_real)
-
-        return cpu_job_id, gpu_job_id
-
-
-def run():
-    global log
-
-    mydir = os.path.dirname(__file__)
-    cfg_parser = ConfigParser({"cfg-files": "cfg.py",
-                               "slurm-options": "",
-                               "prolog": os.path.join(mydir, "prolog.sh"),
-                               })
-    cfg_parser.read("submit.cfg")
-
-    arg_parser = ArgumentParser(description="Submit SLURM jobs.")
-    arg_parser.add_argument("directories", metavar="directory", nargs='+',
-                            help="directories to submit")
-    arg_parser.add_argument("--update", "-u", action='store_true',
-                            help="only submit job if input is more recent than output")
-    arg_parser.add_argument("--retry-failed", "-r", action='store_true',
-                            help="retry previously failed, unchanged configurations if --update is specified")
-    arg_parser.add_argument("--cfg-files", "-c", default=cfg_parser.get("DEFAULT", "cfg-files"),
-                            help="configuration files for each job")
-    arg_parser.add_argument("--log-file", "-l",
-                            help="file to redirect standard output and error to. "
-                                 "Overrides the value specified in the job configuration file.")
-    arg_parser.add_argument("--slurm-option", "-O",
-                            default=arg_split(cfg_parser.get("DEFAULT", "slurm-options"), ","),
-                            action='append',
-                            help="option (without --) that should be passed to sbatch "
-                                 "(specify multiple times for more than one option)")
-    arg_parser.add_argument("--gpu", "-g",
-                            default=None, choices=["yes", "prefer", "no"],
-                            help="GPU access. "
-                                 "Specify 'yes' if the job requires a GPU to run. "
-                                 "Specify 'prefer' if the gpu can make use of a GPU but does not require it to run. "
-                                 "Specify 'no' if no GPU should be allocated. "
-                                 "Overrides the value specified in the job configuration file.")
-    arg_parser.add_argument("--prolog",
-                            default=cfg_parser.get("DEFAULT", "prolog"),
-                            help="script that should be sourced before executing the task. "
-                                 "Specify 'none' for no prolog script.")
-    arg_parser.add_argument("--option", "-o", default=[], action='append',
-                            help="additional argument that should be passed to the runner "
-                                 "(specify multiple times for more than one option)")
-    arg_parser.add_argument("--debug", action='store_true',
-                            help="displays debug output")
-    args = arg_parser.parse_args()
-
-    # initialize logging
-    logging.basicConfig()
-    log = logging.getLogger("jobsubmitter")
-    if args.debug:
-        log.setLevel(logging.DEBUG)
-    else:
-        log.setLevel(logging.WARNING)
-
-    slurm_options = ["--" + o for o in args.slurm_option]
-    prolog=args.prolog
-    if prolog and prolog == "none":
-        prolog = None
-
-    try:
-        js = JobSubmitter(script=os.path.join(mydir, "job-script.sh"),
-                          cfg_files=arg_split(args.cfg_files, ","),
-                          update=args.update,
-                          retry_failed=args.retry_failed,
-                          log_file=args.log_file,
-                          slurm_options=slurm_options,
-                          gpu=args.gpu,
-                          prolog=prolog,
-                          options=args.option)
-    except SubmissionError as e:
-        print e.message
-        sys.exit(1)
-
-    for directory in args.directories:
-        print "%20s: " % directory,
-        if args.debug:
-            print
-        sys.stdout.flush()
-        try:
-            cpu_id, gpu_id = js.submit_directory(directory)
-            if cpu_id and gpu_id:
-                print "cpu: %5d   gpu: %5d" % (cpu_id, gpu_id)
-            elif cpu_id:
-                print "%5d" % cpu_id
-            else:
-                print "%5d" % gpu_id
-        except SubmissionError as e:
-            print e.message
-
-
-if __name__ == '__main__':
-    run()
+import glob
+import os
+import os.path
+import sys
+import logging
+import re
+
+from argparse import ArgumentParser
+from ConfigParser import ConfigParser
+import subprocess
+import tempfile
+import threading
+import time
+
+from manifest import Manifest, find_entry, scan_directory
+from metrics import Metrics
+from resources import History, Predictor, option_aliases, option_name, read_parameters, replace_options, \
+    resource_options
+from resultstore import ResultStore, copy_results, result_key
+from status import query_squeue
+
+log = logging.getLogger("jobsubmitter")
+log.addHandler(logging.NullHandler())
+
+
+def arg_split(args, sep=","):
+    return [f.strip() for f in args.split(sep) if len(f) > 0]
+
+
+class SubmissionError(Exception):
+    pass
+
+
+# sbatch errors that mean that the controller was never reached and the job was therefore not submitted.
+# Other errors like timeouts are ambiguous, because the controller may have accepted the job already.
+not_submitted_errors = re.compile(r"Unable to contact slurm controller|connect failure")
+
+
+class Configuration(object):
+    cached_attributes = ["runner", "input_files", "log_file", "gpu", "stage_in", "depends_on",
+                         "slurm_options", "slurm_options_gpu", "slurm_options_cpu"]
+
+    def __init__(self, cfg_path, cached=None):
+        self.cfg_path = cfg_path
+
+        self.runner = None
+        self.input_files = []
+        self.log_file = "output.txt"
+        self.gpu = 'no'
+        self.stage_in = False
+        self.depends_on = []
+        self.slurm_options = None
+        self.slurm_options_gpu = None
+        self.slurm_options_cpu = None
+
+        if cached is not None:
+            for name in self.cached_attributes:
+                if name in cached:
+                    setattr(self, name, cached[name])
+        else:
+            self.parse()
+            self.parse_slurm_options()
+
+    def to_dict(self):
+        """Returns the parsed configuration for storage in the manifest."""
+        return dict((name, getattr(self, name)) for name in self.cached_attributes)
+
+    def parse(self):
+        with open(self.cfg_path, 'r') as f:
+            for line in f.readlines():
+                line = line.strip()
+                m = re.match(r"^#\s*SUBMIT:\s*([a-zA-Z\-]+)\s*=\s*(.*)$", line)
+                if m:
+                    name = m.group(1).lower()
+                    value = m.group(2).strip()
+
+                    if name == "runner":
+                        self.runner = value
+                    elif name == "input-files":
+                        self.input_files = arg_split(value)
+                    elif name == "log-file":
+                        self.log_file = value
+                    elif name == "gpu":
+                        value = value.lower()
+                        if value not in ['yes', 'prefer', 'no']:
+                            raise SubmissionError("GPU option %s not recognized" % value)
+                        self.gpu = value
+                    elif name == "stage-in":
+                        value = value.lower()
+                        if value not in ['yes', 'no']:
+                            raise SubmissionError("stage-in option %s not recognized" % value)
+                        self.stage_in = value == 'yes'
+                    elif name == "depends-on":
+                        self.depends_on = arg_split(value)
+                    else:
+                        raise SubmissionError("submit option %s in config file not recognized" % name)
+        if not self.runner:
+            raise SubmissionError("required option runner was not specified in configuration file")
+
+    def parse_slurm_options(self):
+        """Reads SBATCH options from the specified configuration file."""
+        self.slurm_options = []
+        self.slurm_options_gpu = []
+        self.slurm_options_cpu = []
+        with open(self.cfg_path, 'r') as f:
+            for line in f.readlines():
+                m = re.match(r"^#\s*SBATCH GPU (.*)$", line)
+                if m is not None:
+                    self.slurm_options_gpu.append(m.group(1).strip())
+                    continue
+
+                m = re.match(r"^#\s*SBATCH CPU (.*)$", line)
+                if m is not None:
+                    self.slurm_options_cpu.append(m.group(1).strip())
+                    continue
+
+                m = re.match(r"^#\s*SBATCH (.*)$", line)
+                if m is not None:
+                    self.slurm_options.append(m.group(1).strip())
+
+
+class RateLimiter(object):
+    """Limits the rate of calls to the SLURM controller across all threads."""
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_call = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Blocks until the next call is allowed."""
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.time()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Job(object):
+    """A directory that has been checked and is ready for submission."""
+    def __init__(self, directory, cfg, cfg_filename, log_path, gpu, cpu_options, gpu_options, stage_in=False):
+        self.directory = directory
+        self.cfg = cfg
+        self.cfg_filename = cfg_filename
+        self.log_path = log_path
+        self.gpu = gpu
+        self.cpu_options = cpu_options
+        self.gpu_options = gpu_options
+        self.stage_in = stage_in
+        self.result_key = None
+        self.dependencies = None
+
+    def array_key(self):
+        """Returns a key that is equal for jobs that can share one job array or None."""
+        if self.gpu == 'yes':
+            options = self.gpu_options
+        elif self.gpu == 'no':
+            options = self.cpu_options
+        else:
+            return None
+        return self.gpu, self.cfg.runner, tuple(options)
+
+
+class JobSubmitter(object):
+    def __init__(self, script=None, cfg_files=[], update=False, retry_failed=False,
+                 log_file=None, slurm_options=None, gpu=None, prolog=None, options=[],
+                 array_size=1000, state_dir=".submit", rate_limit=None, retries=0, retry_delay=1.0,
+                 manifest=None, pack_script=None, pack_size=None, pack_tasks=1, metrics=None,
+                 stage_in=None, stage_cache=None, stage_cache_size=0, result_store=None, link_results=False,
+                 predictor=None):
+        self.script = script
+        self.cfg_files = cfg_files
+        self.update = update
+        self.retry_failed = retry_failed
+        self.log_file = log_file
+        self.slurm_options = slurm_options
+        self.gpu = gpu
+        self.prolog = prolog
+        self.options = options
+        self.array_size = array_size
+        self.state_dir = state_dir
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.manifest = manifest
+        self.pack_script = pack_script
+        self.pack_size = pack_size
+        self.pack_tasks = pack_tasks
+        self.metrics = metrics or Metrics()
+        self.cancelled = threading.Event()
+        self.stage_in = stage_in
+        self.stage_cache = stage_cache
+        self.stage_cache_size = stage_cache_size
+        self.result_store = result_store
+        self.link_results = link_results
+        self.predictor = predictor
+        self.array_tasks = {}
+        self.pruned = False
+
+        log.debug("Using job batch script %s" % self.script)
+        log.debug("Using slurm options: %s" % str(self.slurm_options))
+
+    def find_config_file(self, directory):
+        """Returns the first configuration file in the given directory."""
+        for filename in self.cfg_files:
+            cfg_path = os.path.join(directory, filename)
+            if os.path.exists(cfg_path):
+                return cfg_path, filename
+        return None, None
+
+    def get_mtimes(self, directory, files, ignore_missing=False):
+        """Returns an array of the modification times of the specified files."""
+        mtimes = []
+        for file in files:
+            path = os.path.join(directory, file)
+            if ignore_missing and not os.path.isfile(path):
+                continue
+            else:
+                mtimes.append(os.path.getmtime(path))
+        return mtimes
+
+    def check_file_existance(self, directory, files):
+        """Checks that all specified files exist and raises and exception otherwise."""
+        for file in files:
+            path = os.path.join(directory, file)
+            if not os.path.isfile(path):
+                raise SubmissionError("file %s is missing" % path)
+
+    def submit_job(self, job_name, log_path, opts, runner, cfg, device, xpu_twin, script=None):
+        """Submits to SLURM using sbatch and returns the job id."""
+        cmd = ["sbatch", "--job-name=" + job_name, "--output=" + log_path]
+        cmd += opts
+        cmd += [script or self.script, runner, cfg, device, str(xpu_twin), self.prolog]
+        cmd += self.options
+
+        try:
+            output = self.call_slurm(cmd, idempotent=False)
+        except subprocess.CalledProcessError as e:
+            raise SubmissionError("sbatch failed")
+
+        m = re.search("Submitted batch job (\d+)", output)
+        if m:
+            return int(m.group(1))
+        else:
+            raise SubmissionError("sbatch failed with unexpected output: " + output)
+
+    def call_slurm(self, cmd, idempotent=True):
+        """Executes a SLURM command subject to the rate limit and returns its output.
+        Failed commands are retried with exponential backoff. Commands that are not idempotent, i.e. sbatch,
+        are only retried if their error shows that the controller was not reached, because retrying
+        after an ambiguous error like a timeout could submit a job twice."""
+        attempt = 0
+        while True:
+            self.rate_limiter.wait()
+            log.debug("Executing: " + " ".join(cmd))
+            try:
+                with self.metrics.timer(cmd[0]):
+                    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                    output, error = process.communicate()
+                sys.stderr.write(error)
+                if process.returncode:
+                    raise subprocess.CalledProcessError(process.returncode, cmd, output)
+                return output
+            except subprocess.CalledProcessError as e:
+                if attempt >= self.retries or (not idempotent and not not_submitted_errors.search(error)):
+                    raise
+                delay = self.retry_delay * 2 ** attempt
+                attempt += 1
+                self.metrics.count("retries")
+                self.metrics.count("retries_" + cmd[0])
+                log.warning("%s failed with exit code %d, retrying in %g s" % (cmd[0], e.returncode, delay))
+                time.sleep(delay)
+
+    def cancel_job(self, job_id):
+        """Cancels the SLURM job with the given id."""
+        self.cancel_jobs([job_id])
+
+    def cancel_jobs(self, job_ids):
+        """Cancels the SLURM jobs with the given ids using one scancel call."""
+        job_ids = [str(job_id) for job_id in job_ids]
+        try:
+            self.call_slurm(["scancel"] + job_ids)
+        except subprocess.CalledProcessError:
+            raise SubmissionError("scancel failed for job(s) %s" % ",".join(job_ids))
+
+    def release_job(self, job_id):
+        """Releases the held SLURM job with the given id."""
+        self.release_jobs([job_id])
+
+    def release_jobs(self, job_ids):
+        """Releases the held SLURM jobs with the given ids using one scontrol call."""
+        job_ids = ",".join(str(job_id) for job_id in job_ids)
+        try:
+            self.call_slurm(["scontrol", "release", job_ids])
+        except subprocess.CalledProcessError:
+            raise SubmissionError("scontrol release failed for job(s) %s" % job_ids)
+
+    def prepare_directory(self, directory, force=False, workflow=False):
+        """Checks the given directory and returns a Job that is ready for submission.
+        If force is True, the directory is not skipped if it is current. Directories that depend on other
+        directories can only be prepared for a workflow (see submit_workflow)."""
+        with self.metrics.timer("prepare"):
+            if self.manifest is not None:
+                job = self.prepare_directory_cached(directory, force)
+            else:
+                job = self.prepare_directory_uncached(directory, force)
+            if job.cfg.depends_on and not workflow:
+                raise SubmissionError("depends on other directories, submit it with --workflow")
+            if self.result_store is not None and not force:
+                self.reuse_results(job)
+            return job
+
+    def reuse_results(self, job):
+        """Copies the results of a finished directory with identical configuration and input files
+        into the directory of the job and raises a SubmissionError. Otherwise the result key of the job
+        is set so that it is recorded in the result store on submission."""
+        with self.metrics.timer("result_key"):
+            job.result_key = result_key(job.directory, job.cfg_filename, job.cfg.input_files, self.options)
+        source = self.result_store.lookup(job.result_key)
+        if source is None or os.path.samefile(source, job.directory):
+            return
+        with self.metrics.timer("copy_results"):
+            copy_results(source, job.directory, job.cfg.input_files + [job.cfg_filename], link=self.link_results)
+        self.metrics.count("reused_results")
+        if self.manifest is not None:
+            self.manifest.set_job_ids(job.directory, None, None)
+        raise SubmissionError("reused results of %s" % source)
+
+    def prepare_directory_uncached(self, directory, force=False):
+        """Checks the given directory by parsing its configuration file and checking its files one by one."""
+        if not os.path.isdir(directory):
+            raise SubmissionError("specified path is not a directory")
+
+        with self.metrics.timer("find_config"):
+            cfg_path, cfg_filename = self.find_config_file(directory)
+        if not cfg_path:
+            raise SubmissionError("no config file found for directory %s" % directory)
+        log.debug("Using configuration file %s" % cfg_path)
+        with self.metrics.timer("parse"):
+            cfg = Configuration(cfg_path)
+        log.debug("parsed configuration: {" +
+                  ", ".join("%s: %s" % item for item in vars(cfg).items()) + "}")
+
+        # input files
+        input_files = cfg.input_files[:]
+        input_files.append(cfg_filename)
+        with self.metrics.timer("check_files"):
+            self.check_file_existance(directory, input_files)
+
+        # check modification times if update is specified
+        if self.update and not force:
+            with self.metrics.timer("mtimes"):
+                input_mtimes = self.get_mtimes(directory, input_files, ignore_missing=False)
+
+            def marker_mtime(name):
+                path = os.path.join(directory, name)
+                if os.path.exists(path):
+                    return os.path.getmtime(path)
+            self.check_markers(max(input_mtimes), marker_mtime)
+
+        return self.make_job(directory, cfg, cfg_filename)
+
+    def prepare_directory_cached(self, directory, force=False):
+        """Checks the given directory like prepare_directory using a single listing of the directory.
+        The configuration file is only parsed if the input files changed since they were recorded
+        in the manifest."""
+        with self.metrics.timer("scan"):
+            entries = scan_directory(directory)
+        if entries is None:
+            raise SubmissionError("specified path is not a directory")
+
+        cfg_filename = None
+        for filename in self.cfg_files:
+            if filename in entries:
+                cfg_filename = filename
+                break
+        if not cfg_filename:
+            self.manifest.remove(directory)
+            raise SubmissionError("no config file found for directory %s" % directory)
+        cfg_path = os.path.join(directory, cfg_filename)
+
+        record = self.manifest.get(directory)
+        if record and record["cfg_filename"] == cfg_filename and self.manifest.unchanged(record, directory, entries):
+            log.debug("Using configuration of %s from manifest" % cfg_path)
+            self.metrics.count("manifest_hits")
+            cfg = Configuration(cfg_path, cached=record["configuration"])
+        else:
+            log.debug("Using configuration file %s" % cfg_path)
+            try:
+                with self.metrics.timer("parse"):
+                    cfg = Configuration(cfg_path)
+            except SubmissionError:
+                self.manifest.remove(directory)
+                raise
+
+            input_files = cfg.input_files[:]
+            input_files.append(cfg_filename)
+            inputs = {}
+            previous = record["inputs"] if record else {}
+            for filename in input_files:
+                entry = find_entry(entries, directory, filename)
+                if entry is None or not entry.is_file():
+                    self.manifest.remove(directory)
+                    raise SubmissionError("file %s is missing" % os.path.join(directory, filename))
+                with self.metrics.timer("file_state"):
+                    inputs[filename] = self.manifest.file_state(entry, previous.get(filename))
+            record = {"cfg_filename": cfg_filename,
+                      "configuration": cfg.to_dict(),
+                      "inputs": inputs,
+                      "job_ids": record.get("job_ids") if record else None,
+                      "submitted": record.get("submitted") if record else None}
+            self.manifest.put(directory, record)
+
+        if self.update and not force:
+            def marker_mtime(name):
+                entry = entries.get(name)
+                if entry is not None:
+                    return entry.stat().st_mtime
+            self.check_markers(max(state[0] for state in record["inputs"].values()), marker_mtime)
+
+        return self.make_job(directory, cfg, cfg_filename)
+
+    def check_markers(self, most_recent_input, marker_mtime):
+        """Raises a SubmissionError if the directory finished or failed after its most recent input
+        was modified. marker_mtime returns the modification time of a marker file or None if it is missing."""
+        fail_mtime = marker_mtime("_failed")
+        if fail_mtime is not None and fail_mtime >= most_recent_input and not self.retry_failed:
+            self.metrics.count("skipped_failed")
+            raise SubmissionError("failed previously")
+
+        finished_mtime = marker_mtime("_finished")
+        if finished_mtime is not None and finished_mtime >= most_recent_input:
+            self.metrics.count("skipped_current")
+            raise SubmissionError("current")
+
+    def make_job(self, directory, cfg, cfg_filename):
+        """Returns a Job for the given directory and its configuration."""
+        # log file
+        if self.log_file:
+            log_file = self.log_file
+        else:
+            log_file = cfg.log_file
+        log_path = os.path.join(directory, log_file)
+
+        # slurm options
+        slurm_options = self.slurm_options[:]
+        slurm_options += cfg.slurm_options
+        cpu_options = slurm_options[:] + cfg.slurm_options_cpu
+        gpu_options = slurm_options[:] + cfg.slurm_options_gpu
+        gpu_options.append("--gres=gpu")
+
+        # predicted time and memory
+        if self.predictor is not None:
+            parameters = read_parameters(directory)
+            if parameters is not None:
+                cpu_options = self.predict_options(parameters, "cpu", cpu_options)
+                gpu_options = self.predict_options(parameters, "gpu", gpu_options)
+
+        # gpu
+        if self.gpu:
+            gpu = self.gpu
+        else:
+            gpu = cfg.gpu
+
+        # stage-in
+        if self.stage_in is not None:
+            stage_in = self.stage_in
+        else:
+            stage_in = cfg.stage_in
+
+        return Job(directory, cfg, cfg_filename, log_path, gpu, cpu_options, gpu_options, stage_in=stage_in)
+
+    def predict_options(self, parameters, device, options):
+        """Returns options with time and memory requests replaced by the prediction for the given grid
+        parameters. Requests passed on the command line are kept."""
+        prediction = self.predictor.predict(parameters, device)
+        if prediction is None:
+            return options
+        predicted = [option for option in resource_options(*prediction)
+                     if not any(option_name(o) in option_aliases[option_name(option)] for o in self.slurm_options)]
+        self.metrics.count("predicted_" + device)
+        return replace_options(options, predicted)
+
+    def record_submission(self, job, cpu_id, gpu_id):
+        """Records the job ids of a submitted job in the manifest."""
+        self.metrics.count("submitted")
+        if self.manifest is not None:
+            self.manifest.set_job_ids(job.directory, cpu_id, gpu_id)
+        if job.result_key is not None:
+            self.result_store.register(job.result_key, job.directory, job.cfg.input_files + [job.cfg_filename])
+
+    def remove_log(self, job):
+        """Removes the log file of a previous run of the job."""
+        with self.metrics.timer("remove_log"):
+            if os.path.exists(job.log_path):
+                os.unlink(job.log_path)
+
+    def write_stage_file(self, job):
+        """Writes the _stage file that tells the job script to stage the input files of the job
+        to node-local scratch or removes it if the job should run on the shared file system."""
+        stage_path = os.path.join(job.directory, "_stage")
+        if not job.stage_in:
+            if os.path.exists(stage_path):
+                os.unlink(stage_path)
+            return
+        with self.metrics.timer("stage_file"):
+            try:
+                with open(stage_path, 'w') as f:
+                    f.write("python %s\n" % sys.executable)
+                    f.write("helper %s\n" % os.path.join(os.path.abspath(os.path.dirname(__file__)), "stage.py"))
+                    f.write("cache %s\n" % (self.stage_cache or ""))
+                    f.write("cache-size %d\n" % self.stage_cache_size)
+                    for filename in [job.cfg_filename] + job.cfg.input_files:
+                        f.write("file %s\n" % filename)
+            except IOError as e:
+                raise SubmissionError("cannot write %s: %s" % (stage_path, e.strerror))
+
+    def submit_directory(self, directory):
+        """Submits the given directory to the job scheduler."""
+        return self.submit_prepared(self.prepare_directory(directory))
+
+    def try_submit_directory(self, directory):
+        """Submits the given directory and returns its job ids or the SubmissionError that occurred."""
+        try:
+            if self.cancelled.is_set():
+                raise SubmissionError("cancelled")
+            return self.submit_directory(directory)
+        except SubmissionError as e:
+            self.metrics.count("not_submitted")
+            return e
+
+    def try_prepare_directory(self, directory):
+        """Prepares the given directory and returns the Job or the SubmissionError that occurred."""
+        try:
+            return self.prepare_directory(directory)
+        except SubmissionError as e:
+            self.metrics.count("not_submitted")
+            return e
+
+    def try_submit_prepared(self, job):
+        """Submits a prepared job and returns its job ids or the SubmissionError that occurred."""
+        try:
+            return self.submit_prepared(job)
+        except SubmissionError as e:
+            self.metrics.count("not_submitted")
+            return e
+
+    def map(self, func, items, jobs=1):
+        """Applies func to all items using jobs worker threads and yields the results in order."""
+        if jobs <= 1:
+            for item in items:
+                yield func(item)
+            return
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(jobs)
+        try:
+            for result in pool.imap(func, items):
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def iter_submit_directories(self, directories, jobs=1):
+        """Submits the given directories using jobs worker threads.
+        Yields (directory, result) tuples in the order of the given directories, where result
+        is either a (cpu_id, gpu_id) tuple or a SubmissionError."""
+        results = self.map(self.try_submit_directory, directories, jobs)
+        for directory, result in zip(directories, results):
+            yield directory, result
+
+    def submit_prepared(self, job):
+        """Submits a prepared job and returns its cpu and gpu job ids."""
+        with self.metrics.timer("submit"):
+            return self.submit_prepared_job(job)
+
+    def submit_prepared_job(self, job):
+        """Submits a prepared job without recording the duration, see submit_prepared."""
+        directory = job.directory
+        cfg = job.cfg
+        log_path = job.log_path
+        gpu = job.gpu
+        cpu_options = job.cpu_options[:]
+        gpu_options = job.gpu_options[:]
+
+        self.remove_log(job)
+        self.write_stage_file(job)
+
+        gpu_job_id = None
+        cpu_job_id = None
+
+        if gpu == 'yes':
+            gpu_job_id = self.submit_job(directory, log_path, gpu_options, cfg.runner, directory, 'gpu', 0)
+        elif gpu == 'no':
+            cpu_job_id = self.submit_job(directory, log_path, cpu_options, cfg.runner, directory, 'cpu', 0)
+        elif gpu == 'prefer':
+            cpu_options.append("--hold")
+            gpu_options.append("--hold")
+
+            # The GPU twin is submitted first with twin id -1, which tells the job script to read
+            # the id of its CPU twin from the _twin file. Both twins are held until the file is written.
+            twin_path = os.path.join(directory, "_twin")
+            submitted = []
+            try:
+                gpu_job_id = self.submit_job(directory + "(gpu)", log_path, gpu_options,
+                                             cfg.runner, directory, 'gpu', -1)
+                submitted.append(gpu_job_id)
+                cpu_job_id = self.submit_job(directory + "(cpu)", log_path, cpu_options,
+                                             cfg.runner, directory, 'cpu', gpu_job_id)
+                submitted.append(cpu_job_id)
+                log.debug("Got gpu jobid=%d and cpu jobid=%d" % (gpu_job_id, cpu_job_id))
+
+                try:
+                    with open(twin_path, 'w') as f:
+                        f.write("%d\n" % cpu_job_id)
+                except IOError as e:
+                    raise SubmissionError("cannot write %s: %s" % (twin_path, e.strerror))
+
+                if self.cancelled.is_set():
+                    raise SubmissionError("cancelled")
+                self.release_jobs(submitted)
+            except SubmissionError:
+                self.metrics.count("prefer_rollbacks")
+                if submitted:
+                    log.debug("Canceling partially submitted jobs %s" % str(submitted))
+                    try:
+                        self.cancel_jobs(submitted)
+                    except SubmissionError as e:
+                        log.warning(e.message)
+                raise
+
+        self.record_submission(job, cpu_job_id, gpu_job_id)
+        return cpu_job_id, gpu_job_id
+
+    def prune_index_files(self, max_age=24 * 3600):
+        """Removes the index files of job arrays and packed jobs that are no longer queued from the state
+        directory, together with the counters of packed jobs. The logs of packed jobs are kept until they
+        are older than max_age seconds. Index files without a recorded job id, whose submission failed or
+        was interrupted, are removed once they are older than max_age seconds. Nothing is removed if
+        squeue fails."""
+        try:
+            queued = query_squeue()
+        except (OSError, subprocess.CalledProcessError) as e:
+            log.debug("Not pruning index files, squeue failed: %s" % e)
+            return
+        # the job id of an array is the id of one of its tasks, which may end before the others
+        queued = set(queued) | set(job_id.partition("_")[0] for job_id in queued)
+        now = time.time()
+        for index_path in glob.glob(os.path.join(self.state_dir, "array-*.idx")) + \
+                glob.glob(os.path.join(self.state_dir, "pack-*.idx")):
+            base = index_path[:-len(".idx")]
+            try:
+                with open(base + ".job", 'r') as f:
+                    job_id = f.read().strip()
+            except IOError:
+                job_id = None
+            try:
+                if job_id in queued or (job_id is None and now - os.path.getmtime(index_path) < max_age):
+                    continue
+            except OSError:
+                continue
+            for path in [base + ".job"] + glob.glob(base + ".*.next*") + [index_path]:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+        for log_path in glob.glob(os.path.join(self.state_dir, "pack-*.out")):
+            try:
+                if not os.path.exists(log_path[:-len(".out")] + ".idx") and \
+                        now - os.path.getmtime(log_path) >= max_age:
+                    os.unlink(log_path)
+            except OSError:
+                pass
+
+    def write_index_file(self, jobs, prefix="array-"):
+        """Writes the directory and log path of each job to an index file for use by a job array
+        or packed job. Line i of the index file belongs to array task i. Index files of earlier
+        submissions are pruned before the first one is written."""
+        if not os.path.isdir(self.state_dir):
+            os.makedirs(self.state_dir)
+        if not self.pruned:
+            self.pruned = True
+            self.prune_index_files()
+        fd, index_path = tempfile.mkstemp(prefix=prefix, suffix=".idx", dir=self.state_dir)
+        with os.fdopen(fd, 'w') as f:
+            for job in jobs:
+                if "\t" in job.directory or "\n" in job.directory or "\n" in job.log_path:
+                    raise SubmissionError("directory %s cannot be used in a job array" % job.directory)
+                f.write("%s\t%s\n" % (job.directory, job.log_path))
+        return index_path
+
+    def submit_index_job(self, index_path, *args, **kwargs):
+        """Submits a job array or packed job reading index_path like submit_job and stores its id next to
+        the index file, see prune_index_files."""
+        job_id = self.submit_job(*args, **kwargs)
+        try:
+            with open(index_path[:-len(".idx")] + ".job", 'w') as f:
+                f.write("%d\n" % job_id)
+        except IOError as e:
+            log.warning("cannot record the job of %s: %s" % (index_path, e.strerror))
+        return job_id
+
+    def submit_array(self, jobs):
+        """Submits jobs that share the same array key as one SLURM job array.
+        Returns a list of (cpu_id, gpu_id) tuples, one per job."""
+        gpu, runner, options = jobs[0].array_key()
+        device = 'gpu' if gpu == 'yes' else 'cpu'
+
+        for job in jobs:
+            self.remove_log(job)
+            self.write_stage_file(job)
+        with self.metrics.timer("index_file"):
+            index_path = self.write_index_file(jobs)
+
+        job_name = jobs[0].directory
+        if len(jobs) > 1:
+            job_name += " (+%d)" % (len(jobs) - 1)
+        opts = list(options) + ["--array=0-%d" % (len(jobs) - 1)]
+        array_id = self.submit_index_job(index_path, job_name, "/dev/null", opts, runner, index_path, device, 0)
+        self.array_tasks[str(array_id)] = len(jobs)
+
+        ids = []
+        for task, job in enumerate(jobs):
+            task_id = "%d_%d" % (array_id, task)
+            if device == 'gpu':
+                ids.append((None, task_id))
+            else:
+                ids.append((task_id, None))
+            self.record_submission(job, *ids[-1])
+        return ids
+
+    def submit_pack(self, jobs):
+        """Submits jobs that share the same array key as one packed job. The packed job allocates
+        pack_tasks tasks and runs the directories as job steps, one per task at a time.
+        Returns a list of (cpu_id, gpu_id) tuples, one per job."""
+        gpu, runner, options = jobs[0].array_key()
+        device = 'gpu' if gpu == 'yes' else 'cpu'
+
+        for job in jobs:
+            self.remove_log(job)
+            self.write_stage_file(job)
+        with self.metrics.timer("index_file"):
+            index_path = self.write_index_file(jobs, prefix="pack-")
+
+        job_name = jobs[0].directory
+        if len(jobs) > 1:
+            job_name += " (+%d)" % (len(jobs) - 1)
+        opts = list(options) + ["--ntasks=%d" % min(self.pack_tasks, len(jobs)),
+                                "--export=ALL,SUBMIT_JOB_SCRIPT=" + os.path.abspath(self.script)]
+        pack_id = self.submit_index_job(index_path, job_name, index_path[:-len(".idx")] + ".out", opts, runner,
+                                        index_path, device, 0, script=self.pack_script)
+
+        ids = []
+        for job in jobs:
+            if device == 'gpu':
+                ids.append((None, pack_id))
+            else:
+                ids.append((pack_id, None))
+            self.record_submission(job, *ids[-1])
+        return ids
+
+    def submit_many(self, directories, jobs=8):
+        """Submits the given directories using jobs worker threads and yields (directory, result) tuples
+        as soon as each submission completes, where result is either a (cpu_id, gpu_id) tuple or a
+        SubmissionError.
+
+        Closing the generator or interrupting it cancels the submission: directories that were not
+        started yet are not submitted and held twin jobs of GPU-prefer directories in progress are
+        canceled instead of released. The generator returns after all running submissions finished.
+        Only one submit_many call may be active per JobSubmitter at a time."""
+        from multiprocessing.pool import ThreadPool
+
+        def submit(directory):
+            return directory, self.try_submit_directory(directory)
+
+        self.cancelled.clear()
+        pool = ThreadPool(max(jobs, 1))
+        try:
+            for directory, result in pool.imap_unordered(submit, directories):
+                yield directory, result
+        except BaseException:
+            # the generator was closed early or interrupted
+            self.cancelled.set()
+            raise
+        finally:
+            pool.close()
+            pool.join()
+            self.cancelled.clear()
+
+    def submit_directories(self, directories, jobs=1):
+        """Submits the given directories, combining directories with equal SLURM options into job arrays
+        or, if pack_size is set, into packed jobs of pack_size directories each.
+        Directories are checked using jobs worker threads.
+        Returns a list of (directory, result) tuples in the order of the given directories, where result
+        is either a (cpu_id, gpu_id) tuple or a SubmissionError."""
+        prepared = self.map(self.try_prepare_directory, directories, jobs)
+        results = self.submit_grouped(list(prepared), jobs)
+        return zip(directories, results)
+
+    def submit_grouped(self, prepared, jobs=1):
+        """Submits prepared jobs like submit_directories. Entries of prepared that are a SubmissionError
+        are passed through. Returns the results in the order of prepared."""
+        results = {}
+        groups = {}
+        single = []
+        for index, job in enumerate(prepared):
+            if isinstance(job, SubmissionError):
+                results[index] = job
+                continue
+            key = job.array_key()
+            if key is None:
+                single.append((index, job))
+            else:
+                groups.setdefault(key, []).append((index, job))
+
+        single_results = self.map(self.try_submit_prepared, [job for index, job in single], jobs)
+        for (index, job), result in zip(single, single_results):
+            results[index] = result
+
+        if self.pack_size:
+            chunk_size, submit_group = self.pack_size, self.submit_pack
+        else:
+            chunk_size, submit_group = self.array_size, self.submit_array
+        for key, members in groups.items():
+            for start in range(0, len(members), chunk_size):
+                chunk = members[start:start + chunk_size]
+                try:
+                    ids = submit_group([job for index, job in chunk])
+                except SubmissionError as e:
+                    self.metrics.count("not_submitted", len(chunk))
+                    ids = [e] * len(chunk)
+                for (index, job), result in zip(chunk, ids):
+                    results[index] = result
+
+        return [results[index] for index in range(len(prepared))]
+
+    def resolve_dependencies(self, job):
+        """Returns the normalized paths of the directories the job depends on. The depends-on patterns
+        of the configuration are globs relative to the directory of the job."""
+        dependencies = []
+        for pattern in job.cfg.depends_on:
+            matches = [path for path in sorted(glob.glob(os.path.join(job.directory, pattern)))
+                       if os.path.isdir(path)]
+            if not matches:
+                raise SubmissionError("dependency %s matches no directory" % pattern)
+            for path in matches:
+                path = os.path.normpath(path)
+                if path != os.path.normpath(job.directory) and path not in dependencies:
+                    dependencies.append(path)
+        return dependencies
+
+    def prepare_node(self, directory):
+        """Prepares a directory of a workflow. Returns a tuple (job or SubmissionError, current),
+        where current is True if the directory would be skipped as current or received reused results."""
+        try:
+            return self.prepare_directory(directory, workflow=True), False
+        except SubmissionError as e:
+            if e.message != "current":
+                return e, e.message.startswith("reused results")
+        try:
+            return self.prepare_directory(directory, force=True, workflow=True), True
+        except SubmissionError as e:
+            return e, False
+
+    def dependency_option(self, job_ids):
+        """Returns the sbatch option that makes a job wait for the successful completion of the given jobs.
+        Tasks that cover a complete job array submitted by this submitter are replaced by the array id."""
+        tasks = {}
+        for job_id in job_ids:
+            array_id, _, task = str(job_id).partition("_")
+            if task:
+                tasks.setdefault(array_id, set()).add(str(job_id))
+        ids = []
+        for job_id in job_ids:
+            array_id, _, task = str(job_id).partition("_")
+            if task and len(tasks[array_id]) == self.array_tasks.get(array_id):
+                job_id = array_id
+            if str(job_id) not in ids:
+                ids.append(str(job_id))
+        return "--dependency=afterok:" + ":".join(ids)
+
+    def submit_workflow(self, directories, jobs=1, group=False):
+        """Submits the given directories and all directories they depend on (see the depends-on option),
+        so that each job starts after the jobs of its dependencies completed successfully.
+
+        Directories are submitted in topological order in waves of directories whose dependencies were
+        all handled. Within a wave, directories are submitted using jobs worker threads and, if group is
+        True, combined into job arrays or packed jobs like in submit_directories. With update, current
+        directories are skipped unless one of their dependencies is submitted again. A directory is not
+        submitted if one of its dependencies could not be submitted or prefers a GPU, because then it
+        is not known in advance which job will run.
+        Returns a list of (directory, result) tuples in submission order."""
+        nodes = {}
+        pending = []
+        for directory in directories:
+            key = os.path.normpath(directory)
+            if key not in pending:
+                pending.append(key)
+        while pending:
+            prepared = list(self.map(self.prepare_node, pending, jobs))
+            discovered = []
+            for key, (job, current) in zip(pending, prepared):
+                dependencies = []
+                if not isinstance(job, SubmissionError):
+                    try:
+                        dependencies = self.resolve_dependencies(job)
+                    except SubmissionError as e:
+                        job = e
+                nodes[key] = (job, current, dependencies)
+                for dependency in dependencies:
+                    if dependency not in nodes and dependency not in pending and dependency not in discovered:
+                        discovered.append(dependency)
+            pending = discovered
+
+        # topological order in waves
+        remaining = dict((key, set(node[2])) for key, node in nodes.items())
+        waves = []
+        while remaining:
+            wave = sorted(key for key, dependencies in remaining.items() if not dependencies)
+            if not wave:
+                break
+            waves.append(wave)
+            for key in wave:
+                del remaining[key]
+            for dependencies in remaining.values():
+                dependencies.difference_update(wave)
+
+        results = {}
+        finished = set()
+        order = []
+        for wave in waves:
+            ready = []
+            for key in wave:
+                job, current, dependencies = nodes[key]
+                order.append(key)
+                if isinstance(job, SubmissionError):
+                    results[key] = job
+                    if current:
+                        finished.add(key)
+                    continue
+                try:
+                    job_ids = []
+                    for dependency in dependencies:
+                        result = results[dependency]
+                        if dependency in finished:
+                            continue
+                        elif isinstance(result, SubmissionError):
+                            raise SubmissionError("dependency %s was not submitted" % dependency)
+                        elif nodes[dependency][0].gpu == 'prefer':
+                            raise SubmissionError("dependency %s prefers a GPU" % dependency)
+                        else:
+                            job_ids += [job_id for job_id in result if job_id is not None]
+                except SubmissionError as e:
+                    self.metrics.count("not_submitted")
+                    results[key] = e
+                    continue
+                if current and not job_ids:
+                    results[key] = SubmissionError("current")
+                    finished.add(key)
+                    continue
+                job.dependencies = job_ids
+                if job_ids:
+                    option = self.dependency_option(job_ids)
+                    job.cpu_options.append(option)
+                    job.gpu_options.append(option)
+                ready.append((key, job))
+
+            if group:
+                wave_results = self.submit_grouped([job for key, job in ready], jobs)
+            else:
+                wave_results = self.map(self.try_submit_prepared, [job for key, job in ready], jobs)
+            for (key, job), result in zip(ready, wave_results):
+                results[key] = result
+
+        for key in sorted(remaining):
+            self.metrics.count("not_submitted")
+            results[key] = SubmissionError("dependency cycle")
+            order.append(key)
+
+        return [(key, results[key]) for key in order]
+
+
+def print_result(result):
+    """Prints the result of submitting a directory."""
+    if isinstance(result, SubmissionError):
+        print result.message
+        return
+    cpu_id, gpu_id = result
+    if cpu_id and gpu_id:
+        print "cpu: %5s   gpu: %5s" % (cpu_id, gpu_id)
+    elif cpu_id:
+        print "%5s" % cpu_id
+    else:
+        print "%5s" % gpu_id
+
+
+def run():
+    if len(sys.argv) > 1 and sys.argv[1] == "status":
+        from status import run_status
+        run_status(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "clean":
+        from clean import run_clean
+        run_clean(sys.argv[2:])
+        return
+
+    mydir = os.path.dirname(__file__)
+    cfg_parser = ConfigParser({"cfg-files": "cfg.py",
+                               "slurm-options": "",
+                               "prolog": os.path.join(mydir, "prolog.sh"),
+                               "array-size": "1000",
+                               "jobs": "1",
+                               "pack-tasks": "1",
+                               "stage-cache": "",
+                               "stage-cache-size": "0",
+                               "rate-limit": "0",
+                               "retries": "0",
+                               "retry-delay": "1",
+                               "state-dir": ".submit",
+                               "result-store": "",
+                               "resource-margin": "0.2",
+                               })
+    cfg_parser.read("submit.cfg")
+
+    arg_parser = ArgumentParser(description="Submit SLURM jobs. "
+                                            "Run 'submit status directory ...' to show the state of "
+                                            "submitted directories and 'submit clean directory ...' to cancel "
+                                            "their jobs and delete them.")
+    arg_parser.add_argument("directories", metavar="directory", nargs='+',
+                            help="directories to submit")
+    arg_parser.add_argument("--update", "-u", action='store_true',
+                            help="only submit job if input is more recent than output")
+    arg_parser.add_argument("--retry-failed", "-r", action='store_true',
+                            help="retry previously failed, unchanged configurations if --update is specified")
+    arg_parser.add_argument("--cfg-files", "-c", default=cfg_parser.get("DEFAULT", "cfg-files"),
+                            help="configuration files for each job")
+    arg_parser.add_argument("--log-file", "-l",
+                            help="file to redirect standard output and error to. "
+                                 "Overrides the value specified in the job configuration file.")
+    arg_parser.add_argument("--slurm-option", "-O",
+                            default=arg_split(cfg_parser.get("DEFAULT", "slurm-options"), ","),
+                            action='append',
+                            help="option (without --) that should be passed to sbatch "
+                                 "(specify multiple times for more than one option)")
+    arg_parser.add_argument("--gpu", "-g",
+                            default=None, choices=["yes", "prefer", "no"],
+                            help="GPU access. "
+                                 "Specify 'yes' if the job requires a GPU to run. "
+                                 "Specify 'prefer' if the gpu can make use of a GPU but does not require it to run. "
+                                 "Specify 'no' if no GPU should be allocated. "
+                                 "Overrides the value specified in the job configuration file.")
+    arg_parser.add_argument("--prolog",
+                            default=cfg_parser.get("DEFAULT", "prolog"),
+                            help="script that should be sourced before executing the task. "
+                                 "Specify 'none' for no prolog script.")
+    arg_parser.add_argument("--option", "-o", default=[], action='append',
+                            help="additional argument that should be passed to the runner "
+                                 "(specify multiple times for more than one option)")
+    arg_parser.add_argument("--array", "-a", action='store_true',
+                            help="submit directories with equal SLURM options as one job array. "
+                                 "Directories that prefer a GPU are still submitted individually.")
+    arg_parser.add_argument("--array-size", type=int, default=cfg_parser.getint("DEFAULT", "array-size"),
+                            help="maximum number of tasks per job array")
+    arg_parser.add_argument("--pack", "-p", type=int, metavar="K",
+                            help="run K directories with equal SLURM options within one allocation. "
+                                 "Directories that prefer a GPU are still submitted individually.")
+    arg_parser.add_argument("--pack-tasks", type=int, default=cfg_parser.getint("DEFAULT", "pack-tasks"),
+                            help="number of tasks allocated for each packed job, "
+                                 "i.e. the number of directories that run concurrently within it")
+    arg_parser.add_argument("--stage-in", default=None, choices=["yes", "no"],
+                            help="copy the configuration and input files to node-local scratch before running "
+                                 "and copy outputs back afterwards. "
+                                 "Overrides the value specified in the job configuration file.")
+    arg_parser.add_argument("--stage-cache", default=cfg_parser.get("DEFAULT", "stage-cache"),
+                            help="node-local directory that caches staged input files "
+                                 "(default: $TMPDIR/submit-cache-$USER on the node)")
+    arg_parser.add_argument("--stage-cache-size", type=int,
+                            default=cfg_parser.getint("DEFAULT", "stage-cache-size"),
+                            help="size limit of the stage-in cache in MB (0 for no limit)")
+    arg_parser.add_argument("--workflow", "-w", action='store_true',
+                            help="submit the directories and all directories they depend on (see the depends-on "
+                                 "option) so that each job waits for the successful completion of its dependencies")
+    arg_parser.add_argument("--jobs", "-j", type=int, default=cfg_parser.getint("DEFAULT", "jobs"),
+                            help="number of directories to process concurrently")
+    arg_parser.add_argument("--rate-limit", type=float, default=cfg_parser.getfloat("DEFAULT", "rate-limit"),
+                            help="maximum number of SLURM commands per second (0 for no limit)")
+    arg_parser.add_argument("--retries", type=int, default=cfg_parser.getint("DEFAULT", "retries"),
+                            help="number of times a failed SLURM command is retried. sbatch is only retried "
+                                 "if the controller could not be contacted, because after other errors, "
+                                 "e.g. timeouts, the job may have been submitted and a retry would submit it twice")
+    arg_parser.add_argument("--retry-delay", type=float, default=cfg_parser.getfloat("DEFAULT", "retry-delay"),
+                            help="seconds to wait before the first retry, doubled for every further retry")
+    arg_parser.add_argument("--no-manifest", action='store_true',
+                            help="do not use the manifest that caches configurations and input file states "
+                                 "of submitted directories")
+    arg_parser.add_argument("--manifest-hash", action='store_true',
+                            help="compare the contents of input files whose modification time changed "
+                                 "with the contents recorded in the manifest")
+    arg_parser.add_argument("--state-dir", default=cfg_parser.get("DEFAULT", "state-dir"),
+                            help="directory for the manifest and job array index files")
+    arg_parser.add_argument("--result-store", metavar="DIR", default=cfg_parser.get("DEFAULT", "result-store"),
+                            help="directory that maps the contents of configuration and input files to the "
+                                 "directory that computed them. Directories whose contents match a finished "
+                                 "directory receive a copy of its results instead of being submitted.")
+    arg_parser.add_argument("--link-results", action='store_true',
+                            help="hard link reused results instead of copying them")
+    arg_parser.add_argument("--auto-resources", action='store_true',
+                            help="request time and memory predicted from the usage of finished jobs whose grid "
+                                 "parameters are similar instead of the values in the configuration file. "
+                                 "Requires the _params files written by gridsearch(record_parameters=True). "
+                                 "Options passed with --slurm-option are kept.")
+    arg_parser.add_argument("--resource-margin", type=float,
+                            default=cfg_parser.getfloat("DEFAULT", "resource-margin"),
+                            help="fraction added to predicted time and memory")
+    arg_parser.add_argument("--metrics-json", metavar="FILE",
+                            help="write timings of all submission phases and SLURM commands "
+                                 "and event counts to the specified file")
+    arg_parser.add_argument("--debug", action='store_true',
+                            help="displays debug output")
+    args = arg_parser.parse_args()
+
+    # initialize logging
+    logging.basicConfig()
+    if args.debug:
+        log.setLevel(logging.DEBUG)
+    else:
+        log.setLevel(logging.WARNING)
+
+    slurm_options = ["--" + o for o in args.slurm_option]
+    prolog=args.prolog
+    if prolog and prolog == "none":
+        prolog = None
+
+    if args.no_manifest:
+        manifest = None
+    else:
+        manifest = Manifest(os.path.join(args.state_dir, "manifest.json"), use_hash=args.manifest_hash)
+
+    history = None
+    predictor = None
+    if args.auto_resources:
+        if manifest is None:
+            print "--auto-resources requires the manifest"
+            sys.exit(1)
+        history = History(os.path.join(args.state_dir, "history.json"))
+        try:
+            history.harvest(manifest, args.directories)
+        except (OSError, subprocess.CalledProcessError) as e:
+            log.warning("could not query job usage with sacct: %s" % e)
+        predictor = Predictor(history, margin=args.resource_margin)
+
+    try:
+        js = JobSubmitter(script=os.path.join(mydir, "job-script.sh"),
+                          cfg_files=arg_split(args.cfg_files, ","),
+                          update=args.update,
+                          retry_failed=args.retry_failed,
+                          log_file=args.log_file,
+                          slurm_options=slurm_options,
+                          gpu=args.gpu,
+                          prolog=prolog,
+                          options=args.option,
+                          array_size=args.array_size,
+                          rate_limit=args.rate_limit,
+                          retries=args.retries,
+                          retry_delay=args.retry_delay,
+                          state_dir=args.state_dir,
+                          manifest=manifest,
+                          pack_script=os.path.join(mydir, "pack-script.sh"),
+                          pack_size=args.pack,
+                          pack_tasks=args.pack_tasks,
+                          stage_in=None if args.stage_in is None else args.stage_in == "yes",
+                          stage_cache=args.stage_cache,
+                          stage_cache_size=args.stage_cache_size * 1024 * 1024,
+                          result_store=ResultStore(args.result_store) if args.result_store else None,
+                          link_results=args.link_results,
+                          predictor=predictor)
+    except SubmissionError as e:
+        print e.message
+        sys.exit(1)
+
+    try:
+        submit_all(js, args)
+    finally:
+        if manifest is not None:
+            manifest.save()
+        if history is not None:
+            history.save()
+        if args.metrics_json:
+            js.metrics.count("directories", len(args.directories))
+            js.metrics.write_json(args.metrics_json)
+
+
+def submit_all(js, args):
+    """Submits the directories specified on the command line and prints the results."""
+    if args.workflow:
+        for directory, result in js.submit_workflow(args.directories, jobs=args.jobs,
+                                                    group=bool(args.array or args.pack)):
+            print "%20s: " % directory,
+            print_result(result)
+        return
+
+    if args.array or args.pack:
+        for directory, result in js.submit_directories(args.directories, jobs=args.jobs):
+            print "%20s: " % directory,
+            print_result(result)
+        return
+
+    if args.jobs > 1:
+        for directory, result in js.iter_submit_directories(args.directories, jobs=args.jobs):
+            print "%20s: " % directory,
+            print_result(result)
+            sys.stdout.flush()
+        return
+
+    for directory in args.directories:
+        print "%20s: " % directory,
+        if args.debug:
+            print
+        sys.stdout.flush()
+        print_result(js.try_submit_directory(directory))
+
+
+if __name__ == '__main__':
+    run()
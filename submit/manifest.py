@@ -0,0 +1,201 @@
+import fcntl
+import hashlib
+import json
+import os
+import os.path
+import tempfile
+import threading
+import time
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+class Entry(object):
+    """Directory entry used when scandir is not available. The file is only stat'ed when required."""
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self._stat = None
+
+    def stat(self):
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+    def is_file(self):
+        return os.path.isfile(self.path)
+
+
+def scan_directory(directory):
+    """Lists the given directory in one pass and returns a dictionary that maps file names
+    to directory entries or None if the path is not a directory."""
+    try:
+        if scandir is not None:
+            return dict((entry.name, entry) for entry in scandir(directory))
+        else:
+            return dict((name, Entry(directory, name)) for name in os.listdir(directory))
+    except OSError:
+        return None
+
+
+def find_entry(entries, directory, name):
+    """Returns the entry of the file name within directory from the given listing of directory.
+    Files in subdirectories are not part of the listing and get an entry that is stat'ed on demand."""
+    if os.sep in name or (os.altsep and os.altsep in name):
+        entry = Entry(directory, name)
+        try:
+            entry.stat()
+        except OSError:
+            return None
+        return entry
+    return entries.get(name)
+
+
+def file_hash(path):
+    """Returns the SHA1 hash of the contents of the specified file."""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(1 << 20)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
+
+
+class Manifest(object):
+    """Records the configuration, the state of the input files and the submitted jobs of each directory.
+    Directories whose input files are unchanged since they were recorded do not need to be parsed again.
+
+    A record has the following entries:
+        cfg_filename:   name of the configuration file
+        configuration:  parsed configuration (see Configuration.to_dict)
+        inputs:         maps each input file to [mtime, size, sha1]; sha1 is None unless hashing is enabled
+        job_ids:        [cpu_id, gpu_id] of the last submission
+        submitted:      time of the last submission
+    """
+    version = 1
+
+    def __init__(self, path, use_hash=False):
+        self.path = path
+        self.use_hash = use_hash
+        self.records = {}
+        self.changed = set()
+        self.removed = set()
+        self.lock = threading.Lock()
+        self.load()
+
+    @staticmethod
+    def key(directory):
+        return os.path.normpath(directory)
+
+    def read(self):
+        """Returns the records stored on disk. A missing or unreadable manifest is treated as empty."""
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return {}
+        if data.get("version") == self.version:
+            return data["directories"]
+        return {}
+
+    def load(self):
+        """Loads the manifest from disk."""
+        self.records = self.read()
+
+    def save(self):
+        """Atomically writes the records that were modified since the last save to disk. The manifest on disk
+        is read again and updated under an exclusive lock, so that concurrent submissions in the same state
+        directory keep each other's records."""
+        with self.lock:
+            if not self.changed and not self.removed:
+                return
+            changed = dict((key, self.records[key]) for key in self.changed)
+            removed = self.removed
+            self.changed = set()
+            self.removed = set()
+        dirname = os.path.dirname(self.path) or "."
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(self.path + ".lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            records = self.read()
+            records.update(changed)
+            for key in removed:
+                records.pop(key, None)
+            fd, tmp_path = tempfile.mkstemp(prefix=".manifest-", dir=dirname)
+            with os.fdopen(fd, 'w') as f:
+                json.dump({"version": self.version, "directories": records}, f)
+            os.rename(tmp_path, self.path)
+
+    def get(self, directory):
+        with self.lock:
+            return self.records.get(self.key(directory))
+
+    def put(self, directory, record):
+        with self.lock:
+            self.records[self.key(directory)] = record
+            self.changed.add(self.key(directory))
+            self.removed.discard(self.key(directory))
+
+    def remove(self, directory):
+        with self.lock:
+            # the record may have been added by a concurrent submission since the manifest was loaded
+            self.records.pop(self.key(directory), None)
+            self.changed.discard(self.key(directory))
+            self.removed.add(self.key(directory))
+
+    def job_directories(self):
+        """Returns a dictionary mapping each recorded job id to the directories it was submitted for.
+        Packed jobs are recorded for several directories."""
+        job_directories = {}
+        with self.lock:
+            for directory, record in self.records.items():
+                for job_id in record.get("job_ids") or []:
+                    if job_id is not None:
+                        job_directories.setdefault(str(job_id), []).append(directory)
+        return job_directories
+
+    def set_job_ids(self, directory, cpu_id, gpu_id):
+        """Records the ids of the jobs submitted for the given directory."""
+        with self.lock:
+            record = self.records.get(self.key(directory))
+            if record is not None:
+                record["job_ids"] = [cpu_id, gpu_id]
+                record["submitted"] = time.time()
+                self.changed.add(self.key(directory))
+
+    def file_state(self, entry, previous=None):
+        """Returns [mtime, size, sha1] of the given directory entry.
+        The hash of the previous state is reused if modification time and size are unchanged."""
+        st = entry.stat()
+        state = [st.st_mtime, st.st_size, None]
+        if self.use_hash:
+            if previous and previous[:2] == state[:2] and previous[2]:
+                state[2] = previous[2]
+            else:
+                state[2] = file_hash(entry.path)
+        return state
+
+    def unchanged(self, record, directory, entries):
+        """Returns True if all input files of the record are unchanged in the given directory entries.
+        A file whose modification time changed counts as unchanged if hashing is enabled and its
+        contents are identical."""
+        for name, state in record["inputs"].items():
+            entry = find_entry(entries, directory, name)
+            if entry is None:
+                return False
+            st = entry.stat()
+            if [st.st_mtime, st.st_size] == state[:2]:
+                continue
+            if self.use_hash and state[2] and st.st_size == state[1] and file_hash(entry.path) == state[2]:
+                continue
+            return False
+        return True
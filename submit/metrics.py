@@ -0,0 +1,63 @@
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+
+def percentile(sorted_values, p):
+    """Returns the p-th percentile (0 <= p <= 100) of the sorted values using the nearest-rank method."""
+    if not sorted_values:
+        return None
+    rank = int(math.ceil(p * len(sorted_values) / 100.0)) - 1
+    return sorted_values[min(max(rank, 0), len(sorted_values) - 1)]
+
+
+class Metrics(object):
+    """Collects durations of named phases and counts of named events from multiple threads."""
+
+    def __init__(self):
+        self.durations = {}
+        self.counters = {}
+        self.start_time = time.time()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, name):
+        """Context manager that records the duration of the enclosed block under the given name."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - start)
+
+    def add(self, name, duration):
+        with self.lock:
+            self.durations.setdefault(name, []).append(duration)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self):
+        """Returns a histogram summary (count, total, p50, p95, max in seconds) of each phase
+        and the value of each counter."""
+        with self.lock:
+            durations = dict((name, sorted(values)) for name, values in self.durations.items())
+            counters = dict(self.counters)
+        timings = {}
+        for name, values in durations.items():
+            timings[name] = {"count": len(values),
+                             "total": sum(values),
+                             "p50": percentile(values, 50),
+                             "p95": percentile(values, 95),
+                             "max": values[-1]}
+        return {"wall_time": time.time() - self.start_time,
+                "timings": timings,
+                "counters": counters}
+
+    def write_json(self, path):
+        """Writes the summary to the specified file."""
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=1, sort_keys=True)
+            f.write("\n")
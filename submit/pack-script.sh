@@ -0,0 +1,82 @@
+#!/bin/bash
+#SBATCH --signal=INT@600
+#SBATCH --open-mode=append
+
+# Runs the directories listed in an index file within one allocation.
+# One worker per allocated task takes the next directory from the index
+# file and runs it using the job script, which executes the runner as a
+# single-task job step and writes the markers and log of the directory.
+# The packed job fails if any of its directories did not finish successfully,
+# so that jobs depending on it with afterok do not start.
+
+function claim_next {
+    (
+        flock 9
+        n=$(cat "$counter")
+        echo $((n + 1)) > "$counter"
+        echo $n
+    ) 9> "$counter.lock"
+}
+
+function worker {
+    failed=0
+    while true ; do
+        n=$(claim_next)
+        entry=$(sed -n "$((n + 1))p" "$index")
+        if [ "$entry" == "" ] ; then
+            return $failed
+        fi
+        dir="${entry%%	*}"
+        log_path="${entry#*	}"
+        if [ "$SLURM_RESTART_COUNT" != "" ] && [ -e "$dir/_finished" ] ; then
+            echo "Skipping finished $dir"
+            continue
+        fi
+        echo "Running $dir"
+        bash "$SUBMIT_JOB_SCRIPT" "$runner" "$dir" "$device" 0 "$prolog" "$@" >> "$log_path" 2>&1
+        retval=$?
+        echo "Finished $dir with exit code $retval"
+        if [ "$retval" != "0" ] ; then
+            failed=1
+        fi
+    done
+}
+
+function on_signal {
+    kill -TERM $(jobs -p) 2> /dev/null
+    wait
+    exit 1
+}
+
+runner="$1"
+index="$2"
+device="$3"
+prolog="$5"
+shift 5
+
+echo "Job id is $SLURM_JOB_ID"
+echo "Hostname is $(hostname)"
+echo "Running directories from $index using $SLURM_NTASKS tasks"
+
+export SUBMIT_PACKED="yes"
+export SUBMIT_SRUN_OPTIONS="--ntasks=1 --nodes=1 --exclusive"
+
+counter="${index%.idx}.$SLURM_JOB_ID.next"
+echo 0 > "$counter"
+
+trap on_signal TERM
+pids=""
+for ((w = 0; w < ${SLURM_NTASKS:-1}; w++)) ; do
+    worker "$@" &
+    pids="$pids $!"
+done
+retval=0
+for pid in $pids ; do
+    wait $pid || retval=1
+done
+
+rm -f "$counter" "$counter.lock"
+if [ "$retval" != "0" ] ; then
+    echo "Some directories did not finish successfully"
+fi
+exit $retval
@@ -0,0 +1,199 @@
+import json
+import math
+import os
+import os.path
+import re
+import subprocess
+import tempfile
+import threading
+
+devices = ["cpu", "gpu"]
+
+
+def read_parameters(directory):
+    """Returns the grid parameters recorded in the _params file of the directory or None."""
+    try:
+        with open(os.path.join(directory, "_params"), 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def parse_size(text):
+    """Converts a size reported by sacct like 1234K or 1.5G to bytes."""
+    m = re.match(r"([\d.]+)([KMGT]?)$", text.strip())
+    if not m:
+        return None
+    return int(float(m.group(1)) * 1024 ** " KMGT".index(m.group(2) or " "))
+
+
+def query_usage(job_ids):
+    """Returns a dictionary mapping the given job ids to (state, elapsed seconds, MaxRSS in bytes)
+    using one sacct call. MaxRSS is the maximum over all steps of the job."""
+    if not job_ids:
+        return {}
+    output = subprocess.check_output(["sacct", "--noheader", "--parsable2",
+                                      "--format=JobID,State,ElapsedRaw,MaxRSS", "--jobs=" + ",".join(job_ids)])
+    usage = {}
+    for line in output.splitlines():
+        fields = line.split("|")
+        if len(fields) != 4:
+            continue
+        job_id, step = fields[0].partition(".")[::2]
+        state, elapsed, max_rss = usage.get(job_id, ("", 0, 0))
+        if not step:
+            state = fields[1].split()[0] if fields[1] else ""
+            elapsed = int(fields[2] or 0)
+        max_rss = max(max_rss, parse_size(fields[3]) or 0)
+        usage[job_id] = (state, elapsed, max_rss)
+    return usage
+
+
+class History(object):
+    """Elapsed time and peak memory of finished jobs together with the grid parameters of their directory.
+
+    runs maps job ids to records with the following entries:
+        directory:      directory of the job
+        device:         cpu or gpu
+        parameters:     grid parameters of the directory (see GridSearch.generate)
+        elapsed:        elapsed time in seconds
+        max_rss:        peak resident memory in bytes
+    Jobs that did not complete successfully are recorded as None so that they are not queried again.
+    """
+    version = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.runs = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Loads the history from disk. A missing or unreadable history is treated as empty."""
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return
+        if data.get("version") == self.version:
+            self.runs = data["runs"]
+
+    def save(self):
+        """Atomically writes the history to disk if it was modified."""
+        with self.lock:
+            if not self.dirty:
+                return
+            data = json.dumps({"version": self.version, "runs": self.runs})
+            self.dirty = False
+        dirname = os.path.dirname(self.path) or "."
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        fd, tmp_path = tempfile.mkstemp(prefix=".history-", dir=dirname)
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.rename(tmp_path, self.path)
+
+    def harvest(self, manifest, directories):
+        """Records the usage of all jobs of the given directories that are listed in the manifest
+        and not yet part of the history using one sacct call. Returns the number of recorded runs.
+        Jobs that ran several directories (packed jobs) are ignored."""
+        owners = {}
+        for directory in directories:
+            record = manifest.get(directory)
+            job_ids = record.get("job_ids") if record else None
+            for device, job_id in zip(devices, job_ids or []):
+                if job_id is not None:
+                    owners.setdefault(str(job_id), []).append((directory, device))
+        job_ids = [job_id for job_id, users in owners.items() if len(users) == 1 and job_id not in self.runs]
+        if not job_ids:
+            return 0
+
+        usage = query_usage(sorted(job_ids))
+        n_runs = 0
+        with self.lock:
+            for job_id, (state, elapsed, max_rss) in usage.items():
+                if job_id not in owners or len(owners[job_id]) != 1:
+                    continue
+                directory, device = owners[job_id][0]
+                if state in ("PENDING", "RUNNING", "REQUEUED", "SUSPENDED"):
+                    continue
+                parameters = read_parameters(directory)
+                if state != "COMPLETED" or parameters is None:
+                    self.runs[job_id] = None
+                else:
+                    self.runs[job_id] = {"directory": os.path.normpath(directory), "device": device,
+                                         "parameters": parameters, "elapsed": elapsed, "max_rss": max_rss}
+                    n_runs += 1
+                self.dirty = True
+        return n_runs
+
+
+class Predictor(object):
+    """Predicts the elapsed time and peak memory of a directory from the k runs in the history whose
+    grid parameters are closest to those of the directory. The maximum of the neighbours is multiplied
+    by 1 + margin. Numeric parameters are compared relative to their range in the history, other
+    parameters by equality. Only runs on the same device with the same parameter names are considered
+    and no prediction is made if there are fewer than min_runs of them."""
+
+    def __init__(self, history, margin=0.2, k=3, min_runs=3):
+        self.history = history
+        self.margin = margin
+        self.k = k
+        self.min_runs = min_runs
+
+    def predict(self, parameters, device):
+        """Returns (seconds, bytes) for the given parameters or None."""
+        runs = [run for run in self.history.runs.values()
+                if run and run["device"] == device and sorted(run["parameters"]) == sorted(parameters)]
+        if len(runs) < self.min_runs:
+            return None
+
+        spans = {}
+        for name, value in parameters.items():
+            values = [run["parameters"][name] for run in runs]
+            if all(isinstance(v, (int, long, float)) for v in values + [value]):
+                spans[name] = (max(values + [value]) - min(values + [value])) or 1.0
+
+        def distance(run):
+            d = 0.0
+            for name, value in parameters.items():
+                other = run["parameters"][name]
+                if name in spans:
+                    d += (abs(other - value) / spans[name]) ** 2
+                elif other != value:
+                    d += 1.0
+            return d
+
+        neighbours = sorted(runs, key=distance)[:self.k]
+        factor = 1.0 + self.margin
+        return (max(run["elapsed"] for run in neighbours) * factor,
+                max(run["max_rss"] for run in neighbours) * factor)
+
+
+# sbatch options that request time or memory
+option_aliases = {"--time": ["--time", "-t"],
+                  "--mem": ["--mem", "--mem-per-cpu", "--mem-per-gpu"]}
+
+
+def resource_options(seconds, max_rss):
+    """Returns sbatch options requesting the given time and memory. Time is rounded up to 5 minutes
+    and memory to 256 MB, so that directories with similar predictions can share a job array."""
+    options = ["--time=%d" % (5 * max(1, int(math.ceil(seconds / 300.0))))]
+    if max_rss:
+        options.append("--mem=%dM" % (256 * max(1, int(math.ceil(max_rss / float(256 * 1024 ** 2))))))
+    return options
+
+
+def option_name(option):
+    """Returns the name of an sbatch option like --time=10 or "-t 10"."""
+    return re.split(r"[=\s]", option.strip(), 1)[0]
+
+
+def replace_options(options, predicted):
+    """Returns options with the time and memory requests replaced by the predicted options.
+    A predicted option is dropped if one of the fixed options requests the same resource."""
+    names = []
+    for option in predicted:
+        names += option_aliases[option_name(option)]
+    return [option for option in options if option_name(option) not in names] + predicted
@@ -0,0 +1,131 @@
+import errno
+import hashlib
+import json
+import os
+import os.path
+import shutil
+import tempfile
+import threading
+
+# files that describe the state of a job directory and are never copied between directories
+state_files = ["_running", "_finished", "_failed", "_requeued", "_twin", "_stage", "_memoized", "_params"]
+
+
+def result_key(directory, cfg_filename, input_files, options=()):
+    """Returns a hash of the runner options and the contents of the configuration file and the declared
+    input files."""
+    h = hashlib.sha1()
+    h.update(json.dumps(list(options)) + "\0")
+    for filename in [cfg_filename] + sorted(input_files):
+        h.update(filename + "\0")
+        with open(os.path.join(directory, filename), 'rb') as f:
+            while True:
+                data = f.read(1 << 20)
+                if not data:
+                    break
+                h.update(data)
+        h.update("\0")
+    return h.hexdigest()
+
+
+class ResultStore(object):
+    """Maps the result key of a job to the directory that computed its results.
+
+    Each key is stored as a JSON file KEY[:2]/KEY that maps the absolute paths of all directories that
+    were submitted with this key to the modification times and sizes of their input files at submission.
+    A directory only counts as a valid source of results if it finished after its inputs were last
+    modified and its inputs are unchanged."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def record_path(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def read(self, key):
+        try:
+            with open(self.record_path(key), 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def lookup(self, key):
+        """Returns a directory holding the finished results for the key or None."""
+        for directory, inputs in sorted(self.read(key).items()):
+            if finished(directory, inputs):
+                return directory
+        return None
+
+    def register(self, key, directory, input_files):
+        """Records that directory computes the results for the key."""
+        directory = os.path.abspath(directory)
+        inputs = {}
+        for filename in input_files:
+            st = os.stat(os.path.join(directory, filename))
+            inputs[filename] = [st.st_mtime, st.st_size]
+        record_dir = os.path.dirname(self.record_path(key))
+        with self.lock:
+            try:
+                os.makedirs(record_dir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            record = self.read(key)
+            record[directory] = inputs
+            fd, tmp_path = tempfile.mkstemp(dir=record_dir)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(record, f)
+            os.rename(tmp_path, self.record_path(key))
+
+
+def finished(directory, inputs):
+    """Returns whether directory finished after its inputs were last modified and the modification times
+    and sizes of its input files still equal inputs."""
+    try:
+        finished_mtime = os.path.getmtime(os.path.join(directory, "_finished"))
+        for filename, (mtime, size) in inputs.items():
+            st = os.stat(os.path.join(directory, filename))
+            if st.st_mtime != mtime or st.st_size != size or finished_mtime < mtime:
+                return False
+    except OSError:
+        return False
+    return True
+
+
+def link_or_copy(src, dst, link):
+    """Hard links src to dst if link is set, falling back to copying. An existing dst is replaced."""
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    if link:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+
+
+def copy_results(src, dst, exclude, link=False):
+    """Copies (or hard links) all result files of the finished job directory src to dst and marks dst
+    as finished. Files listed in exclude (relative paths) and state files are skipped.
+    Hard links save space but are shared, so a job that overwrites its outputs in place changes both."""
+    exclude = set(os.path.normpath(name) for name in exclude) | set(state_files)
+    for root, dirs, names in os.walk(src):
+        for name in names:
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, src)
+            if rel in exclude:
+                continue
+            target = os.path.join(dst, rel)
+            target_dir = os.path.dirname(target)
+            if not os.path.isdir(target_dir):
+                os.makedirs(target_dir)
+            link_or_copy(path, target, link)
+    for name in ("_failed", "_requeued"):
+        if os.path.exists(os.path.join(dst, name)):
+            os.unlink(os.path.join(dst, name))
+    with open(os.path.join(dst, "_memoized"), 'w') as f:
+        f.write(os.path.abspath(src) + "\n")
+    with open(os.path.join(dst, "_finished"), 'w'):
+        pass
@@ -0,0 +1,187 @@
+"""Stages the input files of a job directory to node-local scratch space and its outputs back.
+
+Usage (called by job-script.sh):
+    python stage.py in DIRECTORY              prints the local working directory
+    python stage.py out DIRECTORY WORKDIR
+
+The files to stage are listed in the _stage file of the job directory, which is written by the submitter:
+    python PATH         interpreter used to run this script
+    helper PATH         path of this script
+    cache PATH          node-local cache directory (empty for the default)
+    cache-size BYTES    size limit of the cache
+    file NAME           file to stage, relative to the job directory
+
+Staged files are kept in a content-addressed cache that is shared by all jobs on a node. Concurrent jobs
+that need the same file lock it, so that it is only copied once. Cached files are hard-linked read-only
+into the working directory of each job. When the cache exceeds its size limit, the least recently used
+files that are not linked into a working directory are evicted.
+"""
+import errno
+import fcntl
+import getpass
+import hashlib
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+
+
+def read_stage_file(directory):
+    settings = {"cache": "", "cache-size": "0"}
+    files = []
+    with open(os.path.join(directory, "_stage"), 'r') as f:
+        for line in f:
+            key, _, value = line.rstrip("\n").partition(" ")
+            if key == "file":
+                files.append(value)
+            else:
+                settings[key] = value
+    return settings, files
+
+
+def default_cache_dir():
+    return os.path.join(os.environ.get("TMPDIR", "/tmp"), "submit-cache-" + getpass.getuser())
+
+
+def make_dirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+class FileLock(object):
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.f = open(self.path, 'a')
+        fcntl.flock(self.f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
+
+
+class Cache(object):
+    """Content-addressed file cache in node-local storage.
+    index/KEY maps the path, size and modification time of a source file to the hash of its contents,
+    blobs/HASH holds the contents."""
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        for sub in ("index", "blobs", "locks", "tmp"):
+            make_dirs(os.path.join(path, sub))
+
+    def fetch(self, src):
+        """Returns the path of the cached copy of src, copying it into the cache if required."""
+        st = os.stat(src)
+        key = hashlib.sha1("%s\0%d\0%r" % (os.path.realpath(src), st.st_size, st.st_mtime)).hexdigest()
+        index_path = os.path.join(self.path, "index", key)
+        with FileLock(os.path.join(self.path, "locks", key)):
+            try:
+                with open(index_path, 'r') as f:
+                    blob = os.path.join(self.path, "blobs", f.read().strip())
+                if os.path.exists(blob):
+                    os.utime(blob, None)
+                    return blob
+            except IOError:
+                pass
+
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.path, "tmp"))
+            h = hashlib.sha1()
+            with open(src, 'rb') as fin:
+                with os.fdopen(fd, 'wb') as fout:
+                    while True:
+                        data = fin.read(1 << 20)
+                        if not data:
+                            break
+                        h.update(data)
+                        fout.write(data)
+            os.chmod(tmp_path, 0o444)
+            blob = os.path.join(self.path, "blobs", h.hexdigest())
+            if os.path.exists(blob):
+                os.unlink(tmp_path)
+                os.utime(blob, None)
+            else:
+                os.rename(tmp_path, blob)
+            with open(index_path + ".tmp", 'w') as f:
+                f.write(h.hexdigest())
+            os.rename(index_path + ".tmp", index_path)
+            return blob
+
+    def evict(self):
+        """Removes least recently used blobs that are not in use until the cache fits its size limit."""
+        if not self.max_size:
+            return
+        with FileLock(os.path.join(self.path, "locks", "evict")):
+            blobs_dir = os.path.join(self.path, "blobs")
+            blobs = []
+            total = 0
+            for name in os.listdir(blobs_dir):
+                path = os.path.join(blobs_dir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                total += st.st_size
+                if st.st_nlink == 1:
+                    blobs.append((st.st_mtime, st.st_size, path))
+            blobs.sort()
+            for mtime, size, path in blobs:
+                if total <= self.max_size:
+                    break
+                os.unlink(path)
+                total -= size
+
+
+def stage_in(directory):
+    settings, files = read_stage_file(directory)
+    cache = Cache(settings["cache"] or default_cache_dir(), int(settings["cache-size"]))
+    job_id = os.environ.get("SLURM_JOB_ID", "local")
+    workdir = tempfile.mkdtemp(prefix="job-%s-" % job_id, dir=cache.path)
+    for name in files:
+        blob = cache.fetch(os.path.join(directory, name))
+        dst = os.path.join(workdir, name)
+        make_dirs(os.path.dirname(dst))
+        try:
+            os.link(blob, dst)
+        except OSError:
+            shutil.copy2(blob, dst)
+    cache.evict()
+    return workdir
+
+
+def stage_out(directory, workdir):
+    """Copies all files that the job created or modified in workdir back to directory
+    and removes workdir."""
+    settings, files = read_stage_file(directory)
+    staged = set(os.path.normpath(name) for name in files)
+    for root, dirs, names in os.walk(workdir):
+        for name in names:
+            src = os.path.join(root, name)
+            rel = os.path.relpath(src, workdir)
+            if rel in staged and os.stat(src).st_nlink > 1:
+                continue
+            dst = os.path.join(directory, rel)
+            make_dirs(os.path.dirname(dst))
+            shutil.copy2(src, dst)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "in":
+        print stage_in(sys.argv[2])
+    elif len(sys.argv) == 4 and sys.argv[1] == "out":
+        stage_out(sys.argv[2], sys.argv[3])
+    else:
+        sys.stderr.write(__doc__)
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
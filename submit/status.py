@@ -0,0 +1,203 @@
+import getpass
+import json
+import os
+import os.path
+import subprocess
+import sys
+
+from argparse import ArgumentParser
+
+from manifest import Manifest, scan_directory
+
+# states of a directory in the order they are reported
+states = ["running", "stale", "pending", "requeued", "finished", "failed", "unsubmitted", "missing"]
+
+
+class DirectoryStatus(object):
+    """State of a submitted directory as indicated by its marker files and the job scheduler."""
+    def __init__(self, directory):
+        self.directory = directory
+        self.state = None
+        self.markers = []
+        self.marker_mtimes = {}
+        self.running_id = None
+        self.job_ids = []
+        self.slurm_state = None
+
+    def to_dict(self):
+        return {"directory": self.directory,
+                "state": self.state,
+                "markers": self.markers,
+                "job_ids": self.job_ids,
+                "slurm_state": self.slurm_state}
+
+
+def read_markers(directory):
+    """Returns the DirectoryStatus of the given directory considering only its marker files."""
+    status = DirectoryStatus(directory)
+    entries = scan_directory(directory)
+    if entries is None:
+        status.state = "missing"
+        return status
+    status.markers = sorted(name for name in ("_running", "_requeued", "_finished", "_failed") if name in entries)
+    for name in status.markers:
+        try:
+            status.marker_mtimes[name] = entries[name].stat().st_mtime
+        except OSError:
+            pass
+    if "_running" in entries:
+        try:
+            with open(entries["_running"].path, 'r') as f:
+                status.running_id = f.read().strip() or None
+        except IOError:
+            pass
+    return status
+
+
+def scan_markers(directories, jobs=16):
+    """Reads the marker files of all directories using jobs threads and returns a list of DirectoryStatus."""
+    if jobs <= 1:
+        return [read_markers(directory) for directory in directories]
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(jobs)
+    try:
+        return pool.map(read_markers, directories, chunksize=64)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def query_squeue(user=None):
+    """Returns a dictionary mapping the ids of all queued jobs of the user to their state using one squeue call.
+    Array tasks are accessible by their own job id and by array_task."""
+    if user is None:
+        user = getpass.getuser()
+    output = subprocess.check_output(["squeue", "--noheader", "--array", "--user=" + user,
+                                      "--format=%A %i %T"])
+    jobs = {}
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) == 3:
+            jobs[fields[0]] = fields[2]
+            jobs[fields[1]] = fields[2]
+    return jobs
+
+
+def query_sacct(job_ids):
+    """Returns a dictionary mapping the given job ids to their final state using one sacct call."""
+    if not job_ids:
+        return {}
+    output = subprocess.check_output(["sacct", "--noheader", "--parsable2", "--allocations",
+                                      "--format=JobID,State", "--jobs=" + ",".join(job_ids)])
+    jobs = {}
+    for line in output.splitlines():
+        fields = line.split("|")
+        if len(fields) == 2:
+            jobs[fields[0]] = fields[1].split()[0] if fields[1] else ""
+    return jobs
+
+
+def job_ids_of(record):
+    """Returns the job ids recorded in a manifest record as strings."""
+    if not record or not record.get("job_ids"):
+        return []
+    return [str(job_id) for job_id in record["job_ids"] if job_id is not None]
+
+
+def directory_status(directories, manifest=None, jobs=16, user=None, use_sacct=True):
+    """Determines the state of all directories with one parallel pass over their marker files,
+    one squeue call and, if jobs whose _running marker is stale exist, one sacct call."""
+    statuses = scan_markers(directories, jobs)
+    queued = query_squeue(user)
+
+    stale_ids = []
+    for status in statuses:
+        if status.state == "missing":
+            continue
+        record = manifest.get(status.directory) if manifest is not None else None
+        status.job_ids = job_ids_of(record)
+        if status.running_id and status.running_id not in status.job_ids:
+            status.job_ids.insert(0, status.running_id)
+
+        live = [job_id for job_id in status.job_ids if job_id in queued]
+        if live:
+            status.slurm_state = queued[live[0]]
+
+        # a queued job only takes precedence over markers left by an earlier run of the directory. Jobs of
+        # packed directories are shared, so markers written after the submission belong to the queued job.
+        submitted = record.get("submitted") if record else None
+        outdated = submitted is not None and all(status.marker_mtimes.get(name, submitted) < submitted
+                                                 for name in status.markers)
+
+        if "_running" in status.markers and status.running_id in queued:
+            status.state = "running"
+            status.slurm_state = queued[status.running_id]
+        elif live and (outdated or not status.markers):
+            status.state = "pending"
+        elif "_running" in status.markers:
+            status.state = "stale"
+            if status.running_id:
+                stale_ids.append(status.running_id)
+        elif "_requeued" in status.markers:
+            status.state = "requeued"
+        elif "_finished" in status.markers:
+            status.state = "finished"
+        elif "_failed" in status.markers:
+            status.state = "failed"
+        else:
+            status.state = "unsubmitted"
+
+    if use_sacct and stale_ids:
+        try:
+            finished = query_sacct(stale_ids)
+        except (OSError, subprocess.CalledProcessError):
+            finished = {}
+        for status in statuses:
+            if status.state == "stale" and status.running_id in finished:
+                status.slurm_state = finished[status.running_id]
+
+    return statuses
+
+
+def count_states(statuses):
+    """Returns a dictionary mapping each state to the number of directories in that state."""
+    counts = dict((state, 0) for state in states)
+    for status in statuses:
+        counts[status.state] += 1
+    return counts
+
+
+def run_status(argv):
+    arg_parser = ArgumentParser(prog="submit status",
+                                description="Show the state of submitted directories.")
+    arg_parser.add_argument("directories", metavar="directory", nargs='+',
+                            help="directories to check")
+    arg_parser.add_argument("--json", action='store_true',
+                            help="print counts and per-directory states as JSON")
+    arg_parser.add_argument("--jobs", "-j", type=int, default=16,
+                            help="number of threads that read marker files")
+    arg_parser.add_argument("--state-dir", default=".submit",
+                            help="directory containing the manifest")
+    arg_parser.add_argument("--no-sacct", action='store_true',
+                            help="do not query the final state of jobs with stale _running markers")
+    args = arg_parser.parse_args(argv)
+
+    manifest = Manifest(os.path.join(args.state_dir, "manifest.json"))
+    try:
+        statuses = directory_status(args.directories, manifest=manifest, jobs=args.jobs,
+                                    use_sacct=not args.no_sacct)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print "squeue failed: %s" % e
+        sys.exit(1)
+    counts = count_states(statuses)
+
+    if args.json:
+        json.dump({"counts": counts, "directories": [status.to_dict() for status in statuses]},
+                  sys.stdout, indent=1)
+        print
+        return
+
+    print "  ".join("%s: %d" % (state, counts[state]) for state in states if counts[state])
+    for status in statuses:
+        print "%s\t%s\t%s\t%s" % (status.directory, status.state,
+                                  ",".join(status.job_ids) or "-", status.slurm_state or "-")